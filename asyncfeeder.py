@@ -0,0 +1,181 @@
+import asyncio
+import os
+import time
+import feeder
+import rlimits
+import timedinput
+
+class AsyncFeeder(feeder.Feeder):
+    '''
+    Class AsyncFeeder
+    a Feeder whose programs run under asyncio: startAll() and runAll() are coroutines, so many
+    rounds with many programs share one event loop without a thread per program or per timer.
+    it takes the same arguments and supports the same input and output modes as Feeder, and fills
+    the same results (returnCode, finishState, wallTime, outputLines, inputDelay, peakMemory, ...),
+    except cpuTime, as programs are reaped by the event loop. warm.WarmJava participants
+    run as a fresh process per case.
+    cancelling startAll() or runAll() kills all programs still running
+    '''
+    async def startAll(self):
+        '''
+        start all programs at the same time, all programs will be running parallelly
+        '''
+        await self.runTogether(sorted(self.names))
+
+    async def runAll(self):
+        '''
+        run all programs one by one, each program will be running seperatedly
+        '''
+        for name in sorted(self.names):
+            await self.runTogether([name])
+
+    async def runTogether(self, names):
+        self.capture = self.getCapture()
+        inputs = []
+        readers = []
+        try:
+            with self.timings.stage("spawn"):
+                for name in names:
+                    await self.spawnAsync(name)
+            self.releaseInput()
+            if self.capture:
+                readers = [asyncio.ensure_future(self.readOutput(name)) for name in names]
+            if self.inputMode == feeder.Feeder.IM_TIMED_STRING:
+                inputs = [asyncio.ensure_future(self.feedTimedAsync(names))]
+            if "memory" in self.limits:
+                inputs.append(asyncio.ensure_future(self.watchMemoryAsync(names)))
+            deadline = time.monotonic() + self.timeOut
+            with self.timings.stage("wait"):
+                await asyncio.gather(*(self.waitOne(name, deadline) for name in names))
+        finally:
+            self.releaseInput()
+            for name in names:
+                if name in self.programs and self.programs[name].returncode == None:
+                    self.kill(name)
+            for task in inputs:
+                task.cancel()
+            await asyncio.gather(*inputs, return_exceptions=True)
+            if readers:
+                # programs are dead by now, only their own children may still hold the pipes
+                (done, pending) = await asyncio.wait(readers, timeout=1.0)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*readers, return_exceptions=True)
+            for name in names:
+                if name in self.programs and self.programs[name].returncode == None:
+                    await self.programs[name].wait()
+            self.collectOutput()
+            self.recordRound(names)
+
+    async def spawnAsync(self, name):
+        # running options which start programs themselves (warm.WarmJava) can't run under the event
+        # loop, their fresh-process command is used instead
+        ro = self.runningOption[name]
+        ro = getattr(ro, "cmd", ro)
+        begin = time.perf_counter()
+        ipt = self.getStdin()
+        try:
+            if rlimits.needed(self.limits):
+                # held at the barrier until its limits are applied, see rlimits.popen()
+                p = await asyncio.create_subprocess_exec(*rlimits.wrap(ro), stdin = ipt, stdout = self.getStdout())
+                await asyncio.get_running_loop().run_in_executor(None, rlimits.release, p.pid, self.limits)
+            else:
+                p = await asyncio.create_subprocess_exec(*ro, stdin = ipt, stdout = self.getStdout())
+        finally:
+            if isinstance(ipt, int) and ipt >= 0:
+                os.close(ipt)
+        self.timings.record("spawn.program", time.perf_counter() - begin)
+        self.programs[name] = p
+        self.startTime[name] = time.monotonic()
+        if self.capture:
+            self.capture.track(name, self.startTime[name], self.output[name] if self.output else None, self.timedOutput)
+        return p
+
+    async def waitOne(self, name, deadline):
+        p = self.programs[name]
+        killed = False
+        try:
+            await asyncio.wait_for(p.wait(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.kill(name)
+            await p.wait()
+            killed = True
+        self._recordExit(name)
+        self.returnCode[name] = p.returncode
+        self.finishState[name] = self.getFinishState(name, killed)
+
+    async def watchMemoryAsync(self, names):
+        while True:
+            await asyncio.sleep(feeder.Feeder.MEMORY_POLL)
+            self.watchMemory(names)
+
+    def kill(self, name):
+        p = self.programs[name]
+        if p.returncode == None:
+            try:
+                p.kill()
+            except ProcessLookupError:
+                pass
+
+    async def readOutput(self, name):
+        stream = self.programs[name].stdout
+        try:
+            while True:
+                data = await stream.read(feeder.OutputCapture.CHUNK)
+                if not data:
+                    break
+                if not self.capture.consume(name, data):
+                    self.onOutputLimit(name)
+                    break
+        finally:
+            self.capture.close(name)
+
+    async def deliver(self, name, queue):
+        '''
+        write what is put into queue to the stdin of program `name`, None means EOF;
+        the program is cut off once its pipe stays full for self.stallLimit seconds
+        '''
+        stdin = self.programs[name].stdin
+        try:
+            while True:
+                item = await queue.get()
+                if item == None:
+                    break
+                (data, scheduled) = item
+                stdin.write(data)
+                try:
+                    await asyncio.wait_for(stdin.drain(), self.stallLimit)
+                except asyncio.TimeoutError:
+                    self.cutOff.add(name)
+                    break
+                self.inputDelay.setdefault(name, []).append(time.monotonic() - scheduled)
+        except (BrokenPipeError, ConnectionResetError):
+            # the program has exited or closed its stdin
+            pass
+        finally:
+            stdin.close()
+
+    async def feedTimedAsync(self, names):
+        '''
+        deliver all timed input described in self.input like Feeder.feedTimed does; each program has
+        its own delivery queue, so one program which stops reading doesn't delay the others
+        '''
+        queues = {name: asyncio.Queue() for name in names}
+        writers = [asyncio.ensure_future(self.deliver(name, queues[name])) for name in names]
+        try:
+            maxtim = 0.0
+            base = time.monotonic()
+            for (tim, data) in timedinput.TimedInput.of(self.input).batches():
+                scheduled = base + tim
+                await asyncio.sleep(max(0.0, scheduled - time.monotonic()))
+                for name in names:
+                    queues[name].put_nowait((data, scheduled))
+                maxtim = tim
+            await asyncio.sleep(max(0.0, base + maxtim + feeder.Feeder.EOF_DELAY - time.monotonic()))
+            for name in names:
+                queues[name].put_nowait(None)
+            await asyncio.gather(*writers)
+        finally:
+            for task in writers:
+                task.cancel()
+            await asyncio.gather(*writers, return_exceptions=True)
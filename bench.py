@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import feeder
+import executor
+import manager
+import stats
+
+class Participants:
+    '''
+    Class Participants
+    in charge of writing the synthetic participants used by Benchmark, each is a python script:
+        echo        writes back every line as soon as it is read
+        sleep       reads all input, then sleeps a little and writes the number of lines
+        flood       writes a lot of output, whatever the input is
+        neverread   never reads its stdin, and ends after a while
+    '''
+    SOURCES = {
+        "echo": (
+            "import sys\n"
+            "for line in sys.stdin:\n"
+            "    sys.stdout.write(line)\n"
+            "    sys.stdout.flush()\n"
+        ),
+        "sleep": (
+            "import sys, time\n"
+            "n = sum(1 for line in sys.stdin)\n"
+            "time.sleep(0.2)\n"
+            "print(n)\n"
+        ),
+        "flood": (
+            "import sys\n"
+            "line = 'x' * 79 + '\\n'\n"
+            "sys.stdout.write(line * 100000)\n"
+        ),
+        "neverread": (
+            "import time\n"
+            "time.sleep(1.0)\n"
+        ),
+    }
+    KINDS = ["echo", "sleep", "flood", "neverread"]
+
+    def __init__(self, path):
+        self.path = path
+        self.scripts = dict()
+        for kind, source in Participants.SOURCES.items():
+            script = os.path.join(path, kind + ".py")
+            with open(script, "w") as f:
+                f.write(source)
+            self.scripts[kind] = script
+
+    def runningOption(self, count, kinds = None):
+        '''
+        return the running options of `count` participants, whose kinds cycle through kinds
+        '''
+        kinds = kinds or Participants.KINDS
+        ret = dict()
+        for i in range(count):
+            kind = kinds[i % len(kinds)]
+            ret["{}{}".format(kind, i)] = [sys.executable, self.scripts[kind]]
+        return ret
+
+class Benchmark:
+    '''
+    Class Benchmark
+    in charge of measuring the judge pipeline itself: rounds of synthetic participants are generated,
+    fed, judged and recorded like Contest does, for growing numbers of participants and input sizes.
+    the rounds per second and the percentiles of each stage (see stats.Timings) are reported
+    '''
+    def __init__(self, path = None, timeOut = 5.0, span = 0.5, lineSize = 40):
+        '''
+        path        the directory to work in, a temporary one by default
+        timeOut     timeout of each round (in sec)
+        span        input lines are spread over this many seconds
+        lineSize    length of each input line
+        '''
+        self.tmp = path == None
+        self.path = tempfile.mkdtemp(prefix="bench-") if self.tmp else path
+        self.timeOut = timeOut
+        self.span = span
+        self.lineSize = lineSize
+        self.participants = Participants(self.path)
+        self.judge = executor.Judge(executor.Judge.FC, executor.Judge.CROSS)
+
+    def close(self):
+        if self.tmp:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def makeInput(self, lines):
+        '''
+        return a timed input of `lines` lines spread over self.span seconds
+        '''
+        payload = "x" * max(0, self.lineSize - 8)
+        return [(round(self.span * i / max(1, lines), 3), "{:07d} {}".format(i, payload)) for i in range(lines)]
+
+    def runRound(self, runningOption, lines, timings, result, index):
+        with timings.stage("generate"):
+            inputlist = self.makeInput(lines)
+            data = os.path.join(self.path, "round{}.in".format(index))
+            with open(data, "w") as f:
+                for (tim, content) in inputlist:
+                    f.write("[{}]{}\n".format(tim, content))
+        names = sorted(runningOption)
+        outputname = manager.DataManager.formatOutputName(names, self.path, os.path.basename(data))
+        fdr = feeder.Feeder(
+            names,
+            runningOption,
+            feeder.Feeder.IM_TIMED_STRING,
+            inputlist,
+            feeder.Feeder.OM_CLASSIC,
+            outputname,
+            self.timeOut,
+            _timings = timings
+        )
+        fdr.startAll()
+        with timings.stage("judge"):
+            verdict = self.judge.judge(names, data, outputname, None, fdr.outputDigest)
+        with timings.stage("record"):
+            result.addRow(data, verdict, {name: (fdr.wallTime.get(name), fdr.cpuTime.get(name), fdr.peakMemory.get(name)) for name in names})
+        timings.count("rounds")
+        for path in [data] + list(outputname.values()):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def measure(self, count, lines, rounds = 5, kinds = None):
+        '''
+        run `rounds` rounds of `count` participants on inputs of `lines` lines, return a dict of
+        the setting, rounds per second, and the summary of stats.Timings
+        '''
+        runningOption = self.participants.runningOption(count, kinds)
+        timings = stats.Timings()
+        pm = manager.ParticipantManager(self.path)
+        pm.names = sorted(runningOption)
+        pm.runningOption = runningOption
+        result = manager.ResultManager(pm, manager.ResultStore(":memory:"))
+        begin = time.perf_counter()
+        for i in range(rounds):
+            self.runRound(runningOption, lines, timings, result, i)
+        elapsed = time.perf_counter() - begin
+        result.store.close()
+        ret = {"participants": count, "lines": lines, "rounds": rounds, "elapsed": elapsed,
+               "roundsPerSecond": rounds / elapsed if elapsed > 0 else None}
+        ret.update(timings.summary())
+        return ret
+
+    def run(self, counts = (1, 2, 4, 8), sizes = (10, 100, 1000), rounds = 5, kinds = None):
+        '''
+        measure every combination of participant count and input size, return the list of results
+        '''
+        return [self.measure(count, lines, rounds, kinds) for count in counts for lines in sizes]
+
+if __name__ == "__main__":
+    # python bench.py [report.json]
+    bench = Benchmark()
+    try:
+        report = bench.run()
+    finally:
+        bench.close()
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            f.write(text)
+    else:
+        print(text)
@@ -0,0 +1,507 @@
+import os
+import io
+import sys
+import json
+import time
+import base64
+import shutil
+import socket
+import hashlib
+import zipfile
+import tempfile
+import threading
+import collections
+import subprocess as sp
+import concurrent.futures as cf
+import logging
+import feeder
+import manager
+
+log = logging.getLogger(__name__)
+
+class Channel:
+    '''
+    Class Channel
+    one end of a connection between the coordinator and a worker, which carries JSON messages,
+    one per line; send() may be called from any thread
+    '''
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        data = (json.dumps(msg) + "\n").encode()
+        with self.lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        '''
+        return the next message, or None once the connection is closed
+        '''
+        try:
+            line = self.reader.readline()
+        except OSError:
+            return None
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.reader.close()
+        self.sock.close()
+
+class Remote:
+    '''
+    Class Remote
+    what the coordinator knows about one connected worker
+    '''
+    def __init__(self, channel, slots):
+        self.channel = channel
+        self.slots = slots
+        self.busy = set()
+        self.lastSeen = time.monotonic()
+        self.alive = True
+
+class Coordinator:
+    '''
+    Class Coordinator
+    in charge of running the rounds of a Contest on worker daemons (see Worker) instead of locally.
+    each (participant, data) pair is one job, sent to a worker with a free slot; participants and
+    data files are shipped once per worker as artifacts keyed by their content hash. workers send
+    heartbeats, a worker silent for DEAD_AFTER heartbeats (or disconnected) is dropped and its jobs
+    are given to others; a job not back within its timeOut plus JOB_MARGIN is queued again, and
+    given up as a runtime error after ATTEMPTS tries; jobs left queued while no job runs for
+    IDLE_LIMIT (no worker connected, or all died) are given up as well. once all participants of
+    a data file are back, outputs are judged on the thread which called run(), and the row is
+    added to contest.result right away.
+    a participant's running option may only refer to files inside its own directory, or to files
+    present at the same path on every worker
+    '''
+    HEARTBEAT = 2.0
+    DEAD_AFTER = 3
+    # time (in sec) a job may take beyond its timeOut, for shipping artifacts and output
+    JOB_MARGIN = 30.0
+    ATTEMPTS = 3
+    # time (in sec) run() waits with jobs queued and none running before giving them up
+    IDLE_LIMIT = 120.0
+
+    def __init__(self, ctst, host = "127.0.0.1", port = 0, timeOut = None):
+        '''
+        ctst is an initialized contest.Contest; port 0 picks a free port, see self.address
+        timeOut is the time each job may take (in sec), see Contest.timeOutFor() for the default
+        '''
+        self.contest = ctst
+        self.timeOut = timeOut
+        self.server = socket.create_server((host, port))
+        self.address = self.server.getsockname()[:2]
+        self.lock = threading.Condition()
+        self.remotes = []
+        self.jobs = collections.deque()
+        self.inflight = dict()
+        self.artifacts = dict()
+        self.participants = dict()
+        self.cases = dict()
+        self.completed = collections.deque()
+        self.counter = 0
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for target in (self.accept, self.monitor):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.running = False
+        self.server.close()
+        with self.lock:
+            remotes = list(self.remotes)
+        for remote in remotes:
+            try:
+                remote.channel.send({"type": "bye"})
+            except OSError:
+                pass
+            self.drop(remote)
+
+    def accept(self):
+        while self.running:
+            try:
+                (sock, addr) = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(Channel(sock),), daemon=True).start()
+
+    def serve(self, channel):
+        msg = channel.receive()
+        if msg == None or msg.get("type") != "hello":
+            channel.close()
+            return
+        remote = Remote(channel, max(1, int(msg.get("slots", 1))))
+        with self.lock:
+            self.remotes.append(remote)
+            self.dispatch()
+        try:
+            while True:
+                msg = channel.receive()
+                if msg == None:
+                    break
+                remote.lastSeen = time.monotonic()
+                if msg["type"] == "need":
+                    (kind, content) = self.artifacts[msg["hash"]]
+                    channel.send({"type": "artifact", "hash": msg["hash"], "kind": kind,
+                                  "content": base64.b64encode(content).decode()})
+                elif msg["type"] == "result":
+                    try:
+                        self.onResult(remote, msg)
+                    except Exception:
+                        log.exception("bad result of job %s", msg.get("job"))
+        except OSError:
+            pass
+        finally:
+            self.drop(remote)
+
+    def monitor(self):
+        while self.running:
+            time.sleep(Coordinator.HEARTBEAT)
+            now = time.monotonic()
+            limit = now - Coordinator.HEARTBEAT * Coordinator.DEAD_AFTER
+            with self.lock:
+                dead = [remote for remote in self.remotes if remote.lastSeen < limit]
+                self.expire(now)
+            for remote in dead:
+                self.drop(remote)
+
+    def expire(self, now):
+        '''
+        queue again the jobs which passed their deadline, self.lock must be held
+        '''
+        for (jobId, (remote, job, deadline)) in list(self.inflight.items()):
+            if deadline > now:
+                continue
+            del self.inflight[jobId]
+            remote.busy.discard(jobId)
+            job["attempt"] = job.get("attempt", 1) + 1
+            if job["attempt"] > Coordinator.ATTEMPTS:
+                log.warning("job %s (%s on %s) given up after %d attempts", jobId, job["name"], job["path"], Coordinator.ATTEMPTS)
+                self.settle(job, Worker.failure(jobId))
+            else:
+                log.warning("job %s (%s on %s) passed its deadline, queued again", jobId, job["name"], job["path"])
+                self.jobs.appendleft(job)
+        self.dispatch()
+
+    def drop(self, remote):
+        '''
+        forget worker `remote`, its unfinished jobs are queued again
+        '''
+        with self.lock:
+            if not remote.alive:
+                return
+            remote.alive = False
+            self.remotes.remove(remote)
+            for jobId in sorted(remote.busy, reverse=True):
+                (owner, job, deadline) = self.inflight.pop(jobId)
+                self.jobs.appendleft(job)
+            remote.busy.clear()
+            self.dispatch()
+            self.lock.notify_all()
+        remote.channel.close()
+
+    def dispatch(self):
+        '''
+        hand queued jobs to workers with free slots, self.lock must be held
+        '''
+        for remote in list(self.remotes):
+            while self.jobs and remote.alive and len(remote.busy) < remote.slots:
+                job = self.jobs.popleft()
+                remote.busy.add(job["job"])
+                self.inflight[job["job"]] = (remote, job, time.monotonic() + job["timeOut"] + Coordinator.JOB_MARGIN)
+                try:
+                    remote.channel.send(job)
+                except OSError:
+                    self.drop(remote)
+        metrics = self.contest.metrics
+        metrics.gauge("jobs_queued", "jobs waiting for a worker").set(len(self.jobs))
+        metrics.gauge("jobs_running", "jobs sent to a worker and not finished").set(len(self.inflight))
+        metrics.gauge("workers", "workers connected").set(len(self.remotes))
+
+    def onResult(self, remote, msg):
+        with self.lock:
+            owner = self.inflight.get(msg["job"])
+            if owner == None or owner[0] is not remote:
+                # the job was given to another worker meanwhile
+                return
+            (owner, job, deadline) = self.inflight.pop(msg["job"])
+            remote.busy.discard(msg["job"])
+            self.settle(job, msg)
+            self.dispatch()
+
+    def abandon(self):
+        '''
+        give up all queued jobs as runtime errors, self.lock must be held
+        '''
+        log.warning("no worker ran a job for %s sec, %d queued jobs given up", Coordinator.IDLE_LIMIT, len(self.jobs))
+        while self.jobs:
+            job = self.jobs.popleft()
+            self.settle(job, Worker.failure(job["job"]))
+        self.dispatch()
+
+    def settle(self, job, msg):
+        '''
+        take msg as the result of job, self.lock must be held; once all participants of its data
+        file are back, run() judges it
+        '''
+        case = self.cases[job["path"]]
+        case[job["name"]] = msg
+        if len(case) == len(self.contest.participant.names):
+            self.completed.append(job["path"])
+            self.lock.notify_all()
+
+    def finishCase(self, data):
+        '''
+        judge the outputs of all participants on data file `data`, and add its row to contest.result
+        '''
+        ctst = self.contest
+        names = ctst.participant.names
+        case = self.cases[data]
+        outputname = manager.DataManager.formatOutputName(names, ctst.path, os.path.basename(data))
+        (finishState, digests, usage) = (dict(), dict(), dict())
+        for name in names:
+            msg = case[name]
+            with open(outputname[name], "wb") as f:
+                f.write(base64.b64decode(msg["output"]))
+            finishState[name] = msg["finishState"]
+            digests[name] = msg["digest"]
+            usage[name] = (msg["wallTime"], msg["cpuTime"], msg["peakMemory"])
+        ret = ctst.judgeRound(data, names, outputname, finishState, digests)
+        ctst.record(data, ret, usage, ctst.data.seeds.get(data))
+
+    def addArtifact(self, kind, content):
+        h = hashlib.sha256(content).hexdigest()
+        self.artifacts[h] = (kind, content)
+        return h
+
+    @staticmethod
+    def packDirectory(path):
+        '''
+        return a zip (as bytes) of all files under path, the same files give the same bytes
+        '''
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+            manifest = manager.Manifest(path)
+            manifest.scan()
+            for f in manifest.allFiles():
+                info = zipfile.ZipInfo(os.path.relpath(f, path).replace(os.sep, "/"))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = (os.stat(f).st_mode & 0o777) << 16
+                with open(f, "rb") as src:
+                    z.writestr(info, src.read())
+        return buf.getvalue()
+
+    def run(self, datas):
+        '''
+        run all participants on all data files in datas on the workers, return the list of data
+        files in the order their rows were added to contest.result
+        '''
+        ctst = self.contest
+        for name in ctst.participant.names:
+            root = os.path.join(ctst.participant.path, name)
+            if name not in self.participants:
+                self.participants[name] = self.addArtifact("zip", Coordinator.packDirectory(root))
+        jobs = []
+        for data in datas:
+            with open(data, "rb") as f:
+                dataHash = self.addArtifact("data", f.read())
+            timeOut = self.timeOut if self.timeOut != None else ctst.timeOutFor(data)
+            self.cases[data] = dict()
+            for name in ctst.participant.names:
+                ro = ctst.participant.runningOption[name]
+                self.counter += 1
+                jobs.append({"type": "job", "job": self.counter, "name": name, "path": data,
+                             "participant": self.participants[name], "root": os.path.join(ctst.participant.path, name),
+                             "command": list(getattr(ro, "cmd", ro)), "data": dataHash,
+                             "timeOut": timeOut, "limits": ctst.limits, "timedOutput": ctst.timedOutput})
+        with self.lock:
+            self.jobs.extend(jobs)
+            self.dispatch()
+        ret = []
+        busy = time.monotonic()
+        while len(ret) < len(datas):
+            with self.lock:
+                while not self.completed:
+                    self.lock.wait(Coordinator.HEARTBEAT)
+                    now = time.monotonic()
+                    if self.inflight or not self.jobs:
+                        busy = now
+                    elif now - busy > Coordinator.IDLE_LIMIT:
+                        self.abandon()
+                ready = list(self.completed)
+                self.completed.clear()
+            # judged here, contest.result and its store belong to this thread
+            for data in ready:
+                try:
+                    self.finishCase(data)
+                except Exception:
+                    log.exception("judging %s failed", data)
+                del self.cases[data]
+                ret.append(data)
+        if ctst.result.store:
+            ctst.result.store.flush()
+        return ret
+
+    @staticmethod
+    def startLocalWorkers(n, address, slots = 1):
+        '''
+        start n workers as local processes connecting to address, return their Popen objects
+        '''
+        cmd = [sys.executable, os.path.abspath(__file__), "worker", address[0], str(address[1]), str(slots)]
+        return [sp.Popen(cmd, stdout=sp.DEVNULL) for i in range(n)]
+
+class Worker:
+    '''
+    Class Worker
+    a daemon which runs jobs of a Coordinator with Feeder, `slots` at a time. artifacts are fetched
+    from the coordinator when first needed and kept in workdir by content hash
+    '''
+    def __init__(self, host, port, workdir = None, slots = 1):
+        self.address = (host, port)
+        self.tmp = workdir == None
+        self.workdir = tempfile.mkdtemp(prefix="worker-") if self.tmp else workdir
+        self.slots = slots
+        self.channel = None
+        self.lock = threading.Lock()
+        self.waiting = dict()
+        self.stopped = threading.Event()
+
+    def serve(self):
+        '''
+        work for the coordinator until it says bye or goes away
+        '''
+        self.channel = Channel(socket.create_connection(self.address))
+        self.channel.send({"type": "hello", "slots": self.slots})
+        heartbeat = threading.Thread(target=self.heartbeat, daemon=True)
+        heartbeat.start()
+        pool = cf.ThreadPoolExecutor(self.slots)
+        try:
+            while True:
+                msg = self.channel.receive()
+                if msg == None or msg["type"] == "bye":
+                    break
+                if msg["type"] == "job":
+                    pool.submit(self.runJob, msg)
+                elif msg["type"] == "artifact":
+                    self.store(msg)
+        finally:
+            self.stopped.set()
+            with self.lock:
+                for event in self.waiting.values():
+                    event.set()
+            pool.shutdown(wait=False)
+            self.channel.close()
+            if self.tmp:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def heartbeat(self):
+        while not self.stopped.wait(Coordinator.HEARTBEAT):
+            try:
+                self.channel.send({"type": "heartbeat"})
+            except OSError:
+                break
+
+    def artifactPath(self, h):
+        return os.path.join(self.workdir, h)
+
+    def fetch(self, h):
+        '''
+        return the local path of artifact h, fetching it from the coordinator if needed
+        '''
+        path = self.artifactPath(h)
+        with self.lock:
+            if os.path.exists(path):
+                return path
+            event = self.waiting.get(h)
+            if event == None:
+                event = self.waiting[h] = threading.Event()
+                self.channel.send({"type": "need", "hash": h})
+        event.wait()
+        if not os.path.exists(path):
+            raise OSError("artifact {} is not available".format(h))
+        return path
+
+    def store(self, msg):
+        h = msg["hash"]
+        content = base64.b64decode(msg["content"])
+        if hashlib.sha256(content).hexdigest() == h:
+            path = self.artifactPath(h)
+            tmp = tempfile.mkdtemp(dir=self.workdir) if msg["kind"] == "zip" else path + ".tmp"
+            if msg["kind"] == "zip":
+                with zipfile.ZipFile(io.BytesIO(content)) as z:
+                    for info in z.infolist():
+                        z.extract(info, tmp)
+                        os.chmod(os.path.join(tmp, info.filename), (info.external_attr >> 16) or 0o644)
+            else:
+                with open(tmp, "wb") as f:
+                    f.write(content)
+            os.replace(tmp, path)
+        with self.lock:
+            event = self.waiting.pop(h, None)
+        if event:
+            event.set()
+
+    @staticmethod
+    def failure(jobId):
+        '''
+        return the result message of job jobId which couldn't be run, a runtime error
+        '''
+        return {"type": "result", "job": jobId, "finishState": feeder.Feeder.FS_RE, "returnCode": None,
+                "wallTime": None, "cpuTime": None, "peakMemory": None, "digest": None, "output": ""}
+
+    def runJob(self, msg):
+        name = msg["name"]
+        output = os.path.join(self.workdir, "job{}.out".format(msg["job"]))
+        result = Worker.failure(msg["job"])
+        try:
+            root = self.fetch(msg["participant"])
+            data = self.fetch(msg["data"])
+            cmd = [arg.replace(msg["root"], root) for arg in msg["command"]]
+            fdr = feeder.Feeder(
+                [name],
+                {name: cmd},
+                feeder.Feeder.IM_TIMED_STRING,
+                manager.DataManager.parseTimedInput(data),
+                feeder.Feeder.OM_CLASSIC,
+                {name: output},
+                msg["timeOut"],
+                _limits = msg["limits"],
+                _timedOutput = msg.get("timedOutput", False)
+            )
+            fdr.startAll()
+            with open(output, "rb") as f:
+                result["output"] = base64.b64encode(f.read()).decode()
+            result.update({"finishState": fdr.finishState.get(name, feeder.Feeder.FS_OK), "returnCode": fdr.returnCode.get(name),
+                           "wallTime": fdr.wallTime.get(name), "cpuTime": fdr.cpuTime.get(name),
+                           "peakMemory": fdr.peakMemory.get(name), "digest": fdr.outputDigest.get(name)})
+        except Exception as e:
+            # reported as a runtime error of the participant
+            log.warning("job %s failed: %r", msg["job"], e)
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+        try:
+            self.channel.send(result)
+        except OSError:
+            pass
+
+if __name__ == "__main__":
+    # python cluster.py worker HOST PORT [SLOTS] [WORKDIR]
+    if len(sys.argv) < 4 or sys.argv[1] != "worker":
+        print("usage: {} worker HOST PORT [SLOTS] [WORKDIR]".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(2)
+    slots = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    Worker(sys.argv[2], int(sys.argv[3]), sys.argv[5] if len(sys.argv) > 5 else None, slots).serve()
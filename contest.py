@@ -1,33 +1,386 @@
 import feeder
 import manager
 import executor
+import stats
+import launcher
 import os
+import json
+import hashlib
+import time
+import statistics
+import concurrent.futures as cf
+import multiprocessing as mp
+
+_contest = None
+
+# verdicts of programs which did not finish normally, they override the judged verdict
+RUNTIME_VERDICT = {
+    feeder.Feeder.FS_RE    : manager.ResultManager.RE,
+    feeder.Feeder.FS_TLE   : manager.ResultManager.TLE,
+    feeder.Feeder.FS_OLE   : manager.ResultManager.OLE,
+    feeder.Feeder.FS_MLE   : manager.ResultManager.MLE,
+}
+
+def _initWorker(contest, cpuSets, counter):
+    '''
+    initializer of each worker process of Contest.runMany, pin the worker (and all programs it
+    starts) onto its own set of cpus
+    '''
+    global _contest
+    _contest = contest
+    # timings are sent back with each round, see Contest.runMany
+    _contest.timings = stats.Timings()
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if cpuSets and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpuSets[index % len(cpuSets)])
+
+def _runRound(data, content):
+    inputlist = manager.DataManager.parseTimedString(content)
+    (result, usage) = _contest.runRound(data, inputlist)
+    return (data, result, usage, _contest.timings.drain())
 
 class Contest:
-    def __init__(self, path):
+    # longest time a round may take, unless calibrated (in sec)
+    TIMEOUT = 200
+    # a calibrated case is given the time its input lasts, plus MULTIPLE times the runtime of std
+    # beyond the end of its input, plus SLACK (in sec), see calibrate()
+    MULTIPLE = 3.0
+    SLACK = 2.0
+    # a machine is only taken as slower than when calibrated if it is SPEED_TOLERANCE times slower,
+    # smaller differences are noise of measureSpeed()
+    SPEED_TOLERANCE = 1.2
+    CALIBRATION = "calibration.json"
+
+    def __init__(self, path, std = "std", limits = None, storePath = None, launch = False, timedOutput = False):
+        '''
+        limits is the dict of resource limits of each participant, see Feeder
+        storePath, if given, is the SQLite database where all results are kept, see ResultStore
+        launch, if true, starts all participants of a round at the same moment from a helper
+        process where possible, see launcher.Launcher
+        timedOutput, if true, prefixes each line of the output files judged with the time it was printed,
+        for a SPJ checking the timing of output (e.g. of an elevator), see Feeder
+        '''
         self.path = path
+        self.std = std
+        self.limits = limits
         self.participant = manager.ParticipantManager(os.path.join(self.path, "classes"))
         self.data = manager.DataManager(os.path.join(self.path, "data"), ["python", os.path.join(self.path, "gen.py")])
-        self.result = manager.ResultManager(self.participant)
+        self.result = manager.ResultManager(self.participant, manager.ResultStore(storePath) if storePath else None)
         self.judge = executor.Judge(executor.Judge.SPJ, executor.Judge.STD, os.path.join(self.path, "SPJ.exe"))
         self.runner = manager.Runner()
+        # metrics of the whole run, see stats.MetricsServer and stats.SnapshotWriter to expose them
+        self.metrics = stats.Registry()
+        # time of each stage of the pipeline, see stats.Timings
+        self.timings = stats.Timings(registry=self.metrics)
+        self.launcher = launcher.Launcher() if launch and launcher.Launcher.available() else None
+        self.timedOutput = timedOutput
+        self.timeOut = Contest.TIMEOUT
+        # data hash to (runtime of std, machine speed when measured), see calibrate()
+        self.calibration = None
+        self.speed = None
 
     def initialization(self):
         self.participant.detectParticipant()
         self.runner.addDependency(manager.Runner.JAVA, [r"C:\Users\qq567\Documents\OO\code\H6\duipai\lib\elevator-input-hw2-1.3-jar-with-dependencies.jar", r"C:\Users\qq567\Documents\OO\code\H6\duipai\lib\timable-output-1.0-raw-jar-with-dependencies.jar"])
         self.participant.getRunningOption(self.runner)
-        
-    def runOnce(self):
-        data = self.data.generateData()[0]
-        inputlist = manager.DataManager.parseTimedInput(data)
-        outputname = manager.DataManager.formatOutputName(self.participant.names, self.path, os.path.basename(data))
+
+    def feedRound(self, data, inputlist = None, names = None, timeOut = None):
+        '''
+        run participants in names (default: all) on data file `data`, return the Feeder which ran them
+        inputlist is the parsed content of `data`, it is parsed from the file if not given
+        timeOut is the time the round may take (in sec), see timeOutFor() for the default
+        '''
+        if timeOut == None:
+            timeOut = self.timeOutFor(data)
+        if inputlist == None:
+            inputlist = manager.DataManager.parseTimedInput(data)
+        if names == None:
+            names = self.participant.names
+        outputname = manager.DataManager.formatOutputName(names, self.path, os.path.basename(data))
         fdr = feeder.Feeder(
-            self.participant.names,
+            names,
             self.participant.runningOption,
             feeder.Feeder.IM_TIMED_STRING,
             inputlist,
             feeder.Feeder.OM_CLASSIC,
             outputname,
-            200
+            timeOut,
+            _limits = self.limits,
+            _timings = self.timings,
+            _launcher = self.launcher,
+            _timedOutput = self.timedOutput
         )
         fdr.startAll()
+        return fdr
+
+    def runRound(self, data, inputlist = None, names = None, timeOut = None):
+        '''
+        run and judge participants in names (default: all) on data file `data`, return a tuple
+        (verdicts, usage), which are dicts of name to verdict and to (wall time, cpu time, peak memory)
+        timeOut is the time the round may take (in sec), see timeOutFor() for the default
+        '''
+        if names == None:
+            names = self.participant.names
+        fdr = self.feedRound(data, inputlist, names, timeOut)
+        usage = dict()
+        for name in names:
+            usage[name] = (fdr.wallTime.get(name), fdr.cpuTime.get(name), fdr.peakMemory.get(name))
+        ret = self.judgeRound(data, names, fdr.output, fdr.finishState, fdr.outputDigest)
+        return (ret, usage)
+
+    def record(self, data, result, usage = None, seed = None):
+        '''
+        add the verdicts of a round to self.result, and count them in self.metrics
+        '''
+        self.result.addRow(data, result, usage, seed)
+        for verdict in result.values():
+            self.metrics.counter("verdicts_total", "verdicts given to participants",
+                                 verdict=manager.ResultManager.VERDICT_NAMES.get(verdict, verdict)).inc()
+
+    def judgeRound(self, data, names, outputname, finishState, digests = None):
+        '''
+        judge the output files in outputname of participants in names on data file `data`, return
+        a dict of name to verdict; finishState is the dict of name to how each program finished,
+        digests is the dict of name to digest of captured output, see Feeder
+        '''
+        if self.judge.digestMode() != executor.Comparator.TOKEN:
+            # digests of captured output match Comparator.digest in TOKEN mode only
+            digests = None
+        with self.timings.stage("judge"):
+            ret = self.judge.judge(names, data, outputname, outputname.get(self.std), digests)
+        self.timings.count("rounds")
+        for name in names:
+            state = finishState.get(name, feeder.Feeder.FS_OK)
+            if state in RUNTIME_VERDICT:
+                ret[name] = RUNTIME_VERDICT[state]
+        return ret
+
+    @staticmethod
+    def measureSpeed():
+        '''
+        return the time (in sec) this machine takes for a fixed workload, median of 5 runs;
+        the ratio of two results tells how much slower one machine, or moment, is than the other
+        '''
+        times = []
+        for i in range(5):
+            begin = time.perf_counter()
+            x = 0
+            for j in range(1000000):
+                x += j * j % 7
+            times.append(time.perf_counter() - begin)
+        return statistics.median(times)
+
+    def currentSpeed(self):
+        if self.speed == None:
+            self.speed = Contest.measureSpeed()
+        return self.speed
+
+    def stdDigest(self):
+        manifest = self.participant.manifests.get(self.std)
+        return manifest.sourceDigest() if manifest else None
+
+    def loadCalibration(self):
+        '''
+        load the calibration saved under self.path, unless std changed since
+        '''
+        if self.calibration != None:
+            return
+        self.calibration = dict()
+        try:
+            with open(os.path.join(self.path, Contest.CALIBRATION), "r") as f:
+                saved = json.load(f)
+            if saved["std"] == self.stdDigest():
+                self.calibration = {h: tuple(entry) for h, entry in saved["cases"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def saveCalibration(self):
+        path = os.path.join(self.path, Contest.CALIBRATION)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"std": self.stdDigest(), "cases": self.calibration}, f)
+        os.replace(path + ".tmp", path)
+
+    def calibrate(self, datas = None):
+        '''
+        run std alone once on each data file in datas (default: all saved in the data directory)
+        and record its runtime with the speed of this machine, kept under self.path; later rounds
+        on these files are given a deadline derived from it, see timeOutFor().
+        return a dict of data file to runtime of std
+        '''
+        self.loadCalibration()
+        if datas == None:
+            datas = self.data.savedData()
+        speed = self.currentSpeed()
+        ret = dict()
+        for data in datas:
+            fdr = self.feedRound(data, names=[self.std], timeOut=self.timeOut)
+            if fdr.finishState.get(self.std, feeder.Feeder.FS_OK) != feeder.Feeder.FS_OK:
+                # std itself failed, no deadline can be derived
+                continue
+            ret[data] = fdr.wallTime[self.std]
+            self.calibration[manager.Manifest.hashFile(data)] = (ret[data], speed)
+        self.saveCalibration()
+        return ret
+
+    @staticmethod
+    def inputEnd(data):
+        '''
+        return the time (in sec) after which all input of data file `data` has been fed, EOF included
+        '''
+        times = manager.DataManager.parseTimedInput(data).times
+        return (times[-1] if times else 0.0) + feeder.Feeder.EOF_DELAY
+
+    def timeOutFor(self, data):
+        '''
+        return the time (in sec) a round on data file `data` may take: the time its input lasts,
+        plus MULTIPLE times what std ran beyond the end of the input, plus SLACK. only that part
+        of the runtime is scaled, and scaled up further if this machine is at least SPEED_TOLERANCE
+        times slower now than when it was calibrated; the input schedule takes the same time anywhere.
+        data not calibrated gets self.timeOut, which is also an upper bound
+        '''
+        self.loadCalibration()
+        entry = self.calibration.get(manager.Manifest.hashFile(data))
+        if entry == None:
+            return self.timeOut
+        (runtime, speed) = entry
+        end = Contest.inputEnd(data)
+        factor = self.currentSpeed() / speed
+        if factor < Contest.SPEED_TOLERANCE:
+            factor = 1.0
+        return min(self.timeOut, end + max(0.0, runtime - end) * factor * Contest.MULTIPLE + Contest.SLACK)
+
+    def judgeDigest(self):
+        '''
+        return a hash of everything verdicts depend on besides the participant and the data: the judge
+        settings, the SPJ, and the sources of the outputs compared with (std, or everyone in CROSS mode)
+        '''
+        judge = self.judge
+        h = hashlib.sha256()
+        h.update(repr((judge.compareTool, judge.compareMode, judge.comparator.mode, judge.comparator.tolerance)).encode())
+        if judge.compareTool == executor.Judge.SPJ and judge.spj and os.path.isfile(judge.spj):
+            h.update(manager.Manifest.hashFile(judge.spj).encode())
+        refs = [self.std] if judge.compareMode == executor.Judge.STD else self.participant.names
+        for name in sorted(refs):
+            manifest = self.participant.manifests.get(name)
+            h.update("{}\0{}\0".format(name, manifest.sourceDigest() if manifest else None).encode())
+        return h.hexdigest()
+
+    def resultKey(self, name, dataHash, judgeHash):
+        '''
+        return the key of the verdict of `name` on data with hash dataHash, see regress(). the deadline
+        is keyed by what timeOutFor() computes it from, but the speed of this machine: it is measured
+        anew each session, and a deadline scaled by it would never be the same twice
+        '''
+        manifest = self.participant.manifests.get(name)
+        ro = self.participant.runningOption.get(name)
+        self.loadCalibration()
+        deadline = [self.calibration.get(dataHash), Contest.MULTIPLE, Contest.SLACK, self.timeOut]
+        key = [manifest.sourceDigest() if manifest else None, dataHash, judgeHash, getattr(ro, "cmd", ro), self.limits,
+               deadline]
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def regress(self, datas = None):
+        '''
+        judge all participants on all data files in datas (default: all saved in the data directory),
+        reusing stored verdicts: only pairs whose participant sources, data, judge (SPJ, std),
+        running options or calibration changed since their verdict was stored are run again. in CROSS mode verdicts
+        depend on each other, so a data file is run again for everyone if anyone needs it.
+        verdicts are kept in self.result.store, so a storePath must be given to keep them across
+        sessions. return a tuple (reused, rerun) of the numbers of pairs
+        '''
+        if self.result.store == None:
+            self.result.store = manager.ResultStore(":memory:")
+        store = self.result.store
+        if datas == None:
+            datas = self.data.savedData()
+        names = self.participant.names
+        judgeHash = self.judgeDigest()
+        (reused, rerun) = (0, 0)
+        for data in datas:
+            dataHash = manager.Manifest.hashFile(data)
+            timeOut = self.timeOutFor(data)
+            keys = {name: self.resultKey(name, dataHash, judgeHash) for name in names}
+            cached = store.recall(keys.values())
+            stale = [name for name in names if keys[name] not in cached]
+            if stale and self.judge.compareMode == executor.Judge.CROSS:
+                stale = list(names)
+            (result, usage) = (dict(), dict())
+            for name in names:
+                if name not in stale:
+                    (result[name], usage[name]) = cached[keys[name]]
+            if stale:
+                run = list(stale)
+                if self.judge.compareMode == executor.Judge.STD and self.std not in run:
+                    # std's output is what the others are compared with
+                    run.append(self.std)
+                (ret, use) = self.runRound(data, names=run, timeOut=timeOut)
+                for name in stale:
+                    (result[name], usage[name]) = (ret[name], use[name])
+                    store.remember(keys[name], name, dataHash, ret[name], *use[name])
+            reused += len(names) - len(stale)
+            rerun += len(stale)
+            self.timings.count("regress.reused", len(names) - len(stale))
+            self.timings.count("regress.rerun", len(stale))
+            self.record(data, result, usage)
+        store.flush()
+        return (reused, rerun)
+
+    def runOnce(self):
+        with self.timings.stage("generate"):
+            data = self.data.generateData()[0]
+        self.feedRound(data)
+
+    def runMany(self, n, workers = None, maxProcesses = None):
+        '''
+        run n rounds, each on a freshly generated data file, spread over a pool of `workers`
+        processes (default: one per cpu); each worker is pinned to its own share of the cpus.
+        at most `maxProcesses` participant programs (default: number of cpus) run at the same time,
+        which may lower the number of rounds running at once.
+        data of upcoming rounds is generated in background while earlier rounds run, and each result is added
+        to self.result as soon as its round finishes.
+        return the list of data files in the order their rounds finished
+        '''
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        if not workers:
+            workers = len(cpus)
+        if not maxProcesses:
+            maxProcesses = len(cpus)
+        workers = max(1, min(workers, n, maxProcesses // max(1, len(self.participant.names))))
+        cpuSets = [set(cpus[i::workers]) for i in range(workers)] if len(cpus) >= workers else None
+        # never fork while the data prefetch threads are running
+        ctx = mp.get_context("spawn")
+        counter = ctx.Value("i", 0)
+        finished = []
+        # measured before rounds load the machine, workers get it with self
+        self.loadCalibration()
+        if self.calibration:
+            self.currentSpeed()
+        self.data.startPrefetch(min(n, 2 * workers), count=n)
+        try:
+            with cf.ProcessPoolExecutor(workers, ctx, initializer=_initWorker, initargs=(self, cpuSets, counter)) as pool:
+                pending = set()
+                generated = 0
+                while generated < n or pending:
+                    # keep one round queued behind each worker so no worker waits for data
+                    while generated < n and len(pending) < 2 * workers:
+                        with self.timings.stage("generate"):
+                            (data, content) = self.data.nextData()
+                        pending.add(pool.submit(_runRound, data, content))
+                        generated += 1
+                    self.metrics.gauge("rounds_running", "rounds submitted and not finished").set(len(pending))
+                    self.metrics.gauge("data_ready", "generated data waiting for a round").set(self.data.ready.qsize())
+                    done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                    for future in done:
+                        (data, result, usage, timings) = future.result()
+                        self.timings.merge(timings)
+                        with self.timings.stage("record"):
+                            self.record(data, result, usage, self.data.seeds.get(data))
+                        finished.append(data)
+        finally:
+            self.metrics.gauge("rounds_running", "rounds submitted and not finished").set(0)
+            self.data.stopPrefetch()
+            if self.result.store:
+                self.result.store.flush()
+        return finished
@@ -1,5 +1,8 @@
+import logging
 import contest
 
+logging.basicConfig(level=logging.INFO)
+
 ctst = contest.Contest(r"..\test")
 ctst.initialization()
 ctst.runOnce()
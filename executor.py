@@ -1,8 +1,202 @@
 import sys
+import os
+import re
+import mmap
+import hashlib
 import subprocess as sp
 import tempfile
+import threading
+import queue
+import logging
 import manager
 
+log = logging.getLogger(__name__)
+
+class Comparator:
+    '''
+    Class Comparator
+    in charge of comparing two output files inside this process, files are memory-mapped
+    instead of being read as a whole
+    '''
+    TOKEN   = 0     # compare whitespace separated tokens
+    LINE    = 1     # compare lines, ignoring trailing whitespace and trailing empty lines
+
+    TOKEN_PAT = re.compile(rb"\S+")
+
+    def __init__(self, mode = TOKEN, tolerance = None):
+        '''
+        tolerance, if given, is the largest absolute or relative difference allowed
+        between two tokens which are both numbers
+        '''
+        self.mode = mode
+        self.tolerance = tolerance
+
+    @staticmethod
+    def mapFile(f):
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def sameToken(self, a, b):
+        if a == b:
+            return True
+        if self.tolerance == None:
+            return False
+        try:
+            x = float(a)
+            y = float(b)
+        except ValueError:
+            return False
+        return abs(x - y) <= self.tolerance * max(1.0, abs(y))
+
+    def tokens(self, m):
+        for match in Comparator.TOKEN_PAT.finditer(m):
+            yield match.group()
+
+    def lines(self, m):
+        empty = 0
+        for line in iter(m.readline, b"") if m else []:
+            line = line.rstrip()
+            if not line:
+                empty += 1
+                continue
+            # empty lines only count if something follows them
+            for i in range(empty):
+                yield b""
+            empty = 0
+            yield line
+
+    def compareLine(self, a, b):
+        if self.tolerance == None:
+            return a == b
+        ta = a.split()
+        tb = b.split()
+        return len(ta) == len(tb) and all(self.sameToken(x, y) for (x, y) in zip(ta, tb))
+
+    def digest(self, filename):
+        '''
+        return a digest of the normalized content of filename, i.e. its tokens (TOKEN mode)
+        or its lines without trailing whitespace (LINE mode); files that compare equal without
+        tolerance have the same digest
+        '''
+        h = hashlib.blake2b(digest_size=16)
+        with open(filename, "rb") as f:
+            m = Comparator.mapFile(f)
+            try:
+                self.digestMapped(m, h)
+            finally:
+                if isinstance(m, mmap.mmap):
+                    m.close()
+        return h.hexdigest()
+
+    def digestMapped(self, m, h):
+        units = self.tokens(m) if self.mode == Comparator.TOKEN else self.lines(m)
+        for unit in units:
+            h.update(unit)
+            h.update(b"\n")
+
+    def compareMapped(self, ma, mb):
+        if self.mode == Comparator.TOKEN:
+            (ita, itb, same, unit) = (self.tokens(ma), self.tokens(mb), self.sameToken, "token")
+        else:
+            (ita, itb, same, unit) = (self.lines(ma), self.lines(mb), self.compareLine, "line")
+        index = 0
+        while True:
+            a = next(ita, None)
+            b = next(itb, None)
+            index += 1
+            if a == None and b == None:
+                return (True, "ok, {} {}s".format(index - 1, unit))
+            if a == None or b == None or not same(a, b):
+                return (False, "differ at {} {}: {!r} vs {!r}".format(unit, index, a, b))
+
+    def __call__(self, stdin, filea, fileb):
+        '''
+        compare filea with fileb, return (True, message) iff they are the same
+        '''
+        with open(filea, "rb") as fa, open(fileb, "rb") as fb:
+            ma = Comparator.mapFile(fa)
+            mb = Comparator.mapFile(fb)
+            try:
+                return self.compareMapped(ma, mb)
+            finally:
+                # all slices of the maps are released once compareMapped returns
+                if isinstance(ma, mmap.mmap):
+                    ma.close()
+                if isinstance(mb, mmap.mmap):
+                    mb.close()
+
+class SpjWorker:
+    '''
+    Class SpjWorker
+    in charge of one long-lived SPJ process which judges many cases over a pipe.
+    for each case one line "<stdin>\t<filea>\t<fileb>" is written to the SPJ, which answers
+    one line "<code> <message>", code 0 means accepted. an SPJ which doesn't answer within
+    timeOut seconds is killed, and started again for the next case
+    '''
+    TIMEOUT = 30.0
+
+    def __init__(self, cmd, timeOut = TIMEOUT):
+        self.cmd = cmd if isinstance(cmd, list) else [cmd]
+        self.timeOut = timeOut
+        self.process = None
+        self.replies = None
+
+    def __getstate__(self):
+        # the SPJ process belongs to the process which started it
+        return {"cmd": self.cmd, "timeOut": self.timeOut, "process": None, "replies": None}
+
+    def start(self):
+        if self.process == None or self.process.poll() != None:
+            self.process = sp.Popen(self.cmd, stdin=sp.PIPE, stdout=sp.PIPE, universal_newlines=True, bufsize=1)
+            # replies are read on their own thread, so waiting for one can time out anywhere
+            self.replies = queue.Queue()
+            threading.Thread(target=SpjWorker.read, args=(self.process.stdout, self.replies), daemon=True).start()
+
+    @staticmethod
+    def read(stdout, replies):
+        for line in stdout:
+            replies.put(line)
+        replies.put("")
+
+    def __call__(self, stdin, filea, fileb):
+        self.start()
+        try:
+            self.process.stdin.write("\t".join([stdin, filea, fileb]) + "\n")
+            self.process.stdin.flush()
+            reply = self.replies.get(timeout=self.timeOut)
+        except BrokenPipeError:
+            reply = ""
+        except queue.Empty:
+            log.warning("SPJ gave no answer within %s sec, restarting it", self.timeOut)
+            self.kill()
+            return (False, "SPJ timed out")
+        if not reply:
+            self.close()
+            return (False, "SPJ exited unexpectedly")
+        (code, _, s) = reply.rstrip("\n").partition(" ")
+        return (code == "0", s)
+
+    def kill(self):
+        if self.process != None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def close(self):
+        if self.process != None:
+            if self.process.poll() == None:
+                try:
+                    self.process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                try:
+                    self.process.wait(1)
+                except sp.TimeoutExpired:
+                    self.process.kill()
+                    self.process.wait()
+            self.process = None
+
 class Judge:
     # using what to compare
     FC  = 0         # using system file compare
@@ -22,28 +216,52 @@ class Judge:
 
     @staticmethod
     def fileCompare(stdin, filea, fileb):
-        cmd = [Judge, filea, fileb]
-        tmpf = tempfile.NamedTemporaryFile()
-        p = sp.Popen(cmd, stdout=tmpf)
-        p.wait()
-        tmpf.seek(0)
-        s = tmpf.read()
-        tmpf.close()
-        if p.poll() == 0:
-            return (True, s)
-        else:
-            return (False, s)
+        return Comparator()(stdin, filea, fileb)
 
-    def __init__(self, compareTool, compareMode, spj=None):
+    def __init__(self, compareTool, compareMode, spj=None, persistent=False, fcMode=Comparator.TOKEN, tolerance=None):
+        '''
+        persistent          if True, SPJ is started once and judges all cases over a pipe, see SpjWorker
+        fcMode, tolerance   options of the built-in comparator used by FC, see Comparator
+        '''
         self.spj = spj
         self.compareTool = compareTool
         self.compareMode = compareMode
+        self.comparator = Comparator(fcMode, tolerance)
+        self.spjWorker = SpjWorker(spj) if persistent else None
+        self.groups = []
+
+    def digestMode(self):
+        '''
+        return the Comparator mode outputs are grouped by before compareTool runs, outputs with the
+        same digest are never compared; an SPJ still sees outputs differing in their tokens' layout,
+        only trailing whitespace and trailing empty lines are taken as insignificant to it
+        '''
+        if self.compareTool == Judge.SPJ:
+            return Comparator.LINE
+        return self.comparator.mode
+
+    def getCompareTool(self):
+        if self.compareTool == Judge.SPJ:
+            return self.spjCompare
+        return self.comparator
+
+    def close(self):
+        if self.spjWorker:
+            self.spjWorker.close()
     
     def spjCompare(self, stdin, filea, fileb):
+        if self.spjWorker:
+            return self.spjWorker(stdin, filea, fileb)
         cmd = [self.spj, stdin, filea, fileb]
         tmpf = tempfile.NamedTemporaryFile()
         p = sp.Popen(cmd, stdout=tmpf)
-        p.wait()
+        try:
+            p.wait(SpjWorker.TIMEOUT)
+        except sp.TimeoutExpired:
+            p.kill()
+            p.wait()
+            tmpf.close()
+            return (False, "SPJ timed out")
         tmpf.seek(0)
         s = tmpf.read()
         tmpf.close()
@@ -52,14 +270,40 @@ class Judge:
         else:
             return (False, s)
     
-    def crossCompare(self, names, stdin, partiOut, compareTool):
-        namelist = list(names)
-        N = len(namelist)
-        for i in range(1, N):
-            (ret, s) = compareTool(stdin, partiOut[names[0]], partiOut[names[i]])
-            if not ret:
-                return (ret, s)
-        return (True, "all the same.")
+    def crossCompare(self, names, stdin, partiOut, compareTool, digests = None):
+        '''
+        group participants by the digest of their output, the largest group is the majority;
+        compareTool is run only once per other group, against the majority. if another group,
+        not accepted by it, is as large as the majority with the groups it accepted, there is no
+        majority and everyone is WA.
+        digests is a dict of name to output digest, those missing are computed here.
+        return (verdicts, groups), verdicts is a dict of name to AC/WA, groups is a list of
+        (verdict, message, names) with the majority first
+        '''
+        classes = dict()
+        comparator = self.comparator if self.digestMode() == self.comparator.mode else Comparator(self.digestMode())
+        for name in names:
+            if digests and name in digests:
+                d = digests[name]
+            else:
+                d = comparator.digest(partiOut[name])
+            classes.setdefault(d, []).append(name)
+        members = sorted(classes.values(), key=lambda c: -len(c))
+        major = members[0]
+        groups = [(manager.ResultManager.AC, "majority", major)]
+        for c in members[1:]:
+            (ret, s) = compareTool(stdin, partiOut[major[0]], partiOut[c[0]])
+            groups.append((manager.ResultManager.AC if ret else manager.ResultManager.WA, s, c))
+        accepted = sum(len(c) for (stat, s, c) in groups if stat == manager.ResultManager.AC)
+        if any(stat != manager.ResultManager.AC and len(c) >= accepted for (stat, s, c) in groups):
+            # the largest group is not unique, nobody can be told right
+            log.warning("no majority among %s, all judged WA", [c for (stat, s, c) in groups])
+            groups = [(manager.ResultManager.WA, "no majority", c) for (stat, s, c) in groups]
+        verdicts = dict()
+        for (stat, s, c) in groups:
+            for name in c:
+                verdicts[name] = stat
+        return (verdicts, groups)
 
     def stdCompare(self, names, stdin, stdout, partiOut, compareTool):
         ret = dict()
@@ -71,26 +315,15 @@ class Judge:
                 ret[name] = manager.ResultManager.WA
         return ret
     
-    def judge(self, names, stdin, partiOut, stdout=None):
+    def judge(self, names, stdin, partiOut, stdout=None, digests=None):
         if self.compareMode == Judge.CROSS:
-            (res, s) = (False, "")
-            if self.compareTool == Judge.SPJ:
-                (res, s) = self.crossCompare(names, stdin, partiOut, self.spj)
-            else:
-                (res, s) = self.crossCompare(names, stdin, partiOut, Judge.fileCompare)
-            stat = 0
-            if not res:
-                stat = manager.ResultManager.WA
-                print(s)
-            else:
-                stat = manager.ResultManager.AC
-            return {name: stat for name in names}
+            (ret, groups) = self.crossCompare(names, stdin, partiOut, self.getCompareTool(), digests)
+            self.groups = groups
+            if len(groups) > 1 and log.isEnabledFor(logging.INFO):
+                for (stat, s, c) in groups:
+                    log.info("%s %s %s", stat, c, s)
+            return ret
         elif self.compareMode == Judge.STD:
-            jt = None
-            if self.compareTool == Judge.SPJ:
-                jt = Judge.fileCompare
-            else:
-                jt = self.spjCompare
-            ret = self.stdCompare(names, stdin, stdout, partiOut, jt)
+            ret = self.stdCompare(names, stdin, stdout, partiOut, self.getCompareTool())
             return ret
 
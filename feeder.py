@@ -1,7 +1,312 @@
+import os
+import queue
+import collections
+import hashlib
+import signal
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import selectors
 import subprocess as sp
 import tempfile
 import threading
 import time
+import logging
+import stats
+import timedinput
+import rlimits
+
+log = logging.getLogger(__name__)
+
+class FanoutWriter:
+    '''
+    Class FanoutWriter
+    in charge of writing the same data to the stdin pipes of many programs without blocking,
+    each pipe has its own pending buffer, so a program which stops reading only delays itself.
+    a pipe which stays full for longer than stallLimit seconds is cut off (closed)
+    '''
+    CHUNK = 65536
+
+    def __init__(self, pipes, stallLimit = 5.0):
+        '''
+        pipes is a dict of name to the writable file object (Popen.stdin) of each program
+        '''
+        self.pipes = dict(pipes)
+        self.stallLimit = stallLimit
+        self.buffers = {name: bytearray() for name in self.pipes}
+        self.written = {name: 0 for name in self.pipes}
+        self.queued = {name: 0 for name in self.pipes}
+        self.marks = {name: [] for name in self.pipes}
+        self.stalledSince = dict()
+        self.closing = set()
+        self.cutOff = set()
+        self.delays = dict()
+        self.selector = selectors.DefaultSelector()
+        for name, pipe in self.pipes.items():
+            pipe.flush()
+            os.set_blocking(pipe.fileno(), False)
+
+    def pending(self):
+        '''
+        return true iff some data or EOF is still waiting to be delivered
+        '''
+        return any(self.buffers[name] for name in self.pipes) or bool(self.closing)
+
+    def write(self, data, lst = None, scheduled = None):
+        '''
+        queue bytes `data` for every program in lst and write as much of it as possible right now;
+        if `scheduled` is given, the delay between it and the moment the whole data has been taken
+        by the pipe is recorded in self.delays
+        '''
+        if lst == None:
+            lst = list(self.pipes)
+        for name in lst:
+            if name not in self.pipes:
+                continue
+            self.buffers[name] += data
+            self.queued[name] += len(data)
+            if scheduled != None:
+                self.marks[name].append((self.queued[name], scheduled))
+            self._flush(name)
+
+    def close(self, lst = None):
+        '''
+        feed EOF to every program in lst, as soon as its pending buffer is drained
+        '''
+        if lst == None:
+            lst = list(self.pipes)
+        for name in lst:
+            if name in self.pipes:
+                self.closing.add(name)
+                self._flush(name)
+
+    def pump(self, deadline):
+        '''
+        keep writing pending buffers until they are all drained or time.monotonic() reaches deadline
+        return true iff nothing is pending any more
+        '''
+        while self.pending():
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            self._cutStalled(now)
+            waiting = [name for name in self.pipes if self.buffers[name]]
+            if not waiting:
+                continue
+            for name in waiting:
+                self.selector.register(self.pipes[name].fileno(), selectors.EVENT_WRITE, name)
+            try:
+                timeout = min(deadline, min(self.stalledSince.get(name, now) for name in waiting) + self.stallLimit) - now
+                events = self.selector.select(max(0.0, timeout))
+            finally:
+                for name in waiting:
+                    self.selector.unregister(self.pipes[name].fileno())
+            for key, _ in events:
+                self._flush(key.data)
+        return not self.pending()
+
+    def _flush(self, name):
+        buf = self.buffers[name]
+        pipe = self.pipes[name]
+        while buf:
+            try:
+                n = os.write(pipe.fileno(), memoryview(buf)[:FanoutWriter.CHUNK])
+            except BlockingIOError:
+                self.stalledSince.setdefault(name, time.monotonic())
+                return
+            except (BrokenPipeError, OSError):
+                # the program has exited or closed its stdin
+                self._drop(name)
+                return
+            del buf[:n]
+            self.written[name] += n
+            self.stalledSince.pop(name, None)
+            marks = self.marks[name]
+            while marks and marks[0][0] <= self.written[name]:
+                self.delays.setdefault(name, []).append(time.monotonic() - marks.pop(0)[1])
+        if name in self.closing:
+            self._drop(name)
+
+    def _cutStalled(self, now):
+        for name, since in list(self.stalledSince.items()):
+            if now - since >= self.stallLimit:
+                self.cutOff.add(name)
+                self._drop(name)
+
+    def _drop(self, name):
+        pipe = self.pipes.pop(name)
+        self.buffers[name].clear()
+        self.stalledSince.pop(name, None)
+        self.closing.discard(name)
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+    def closeAll(self):
+        '''
+        drop all pipes, pending data is discarded
+        '''
+        for name in list(self.pipes):
+            self._drop(name)
+        self.selector.close()
+
+class OutputCapture:
+    '''
+    Class OutputCapture
+    in charge of reading the stdout pipes of many programs on one thread through a selector.
+    each program keeps at most keepLines lines, with the time (since its start) each line was read,
+    a program writing more than limit bytes is reported through onLimit, and all output may
+    also be spilled into a file, raw or with the time of each line
+    '''
+    CHUNK = 65536
+    # a timed spill prefixes each line with its time, as the timable-output jar prints it
+    TIME_FORMAT = "[{:10.4f}]"
+
+    def __init__(self, limit = None, keepLines = 10000, onLimit = None):
+        self.limit = limit
+        self.keepLines = keepLines
+        self.onLimit = onLimit
+        self.selector = selectors.DefaultSelector()
+        (self.wakeRead, self.wakeWrite) = os.pipe()
+        self.selector.register(self.wakeRead, selectors.EVENT_READ, None)
+        self.pipes = dict()
+        self.startTime = dict()
+        self.partial = dict()
+        self.spills = dict()
+        self.timedSpills = set()
+        self.lines = dict()
+        self.size = dict()
+        self.digests = dict()
+        self.exceeded = set()
+        self.thread = None
+
+    def track(self, name, startTime, spill = None, timed = False):
+        '''
+        prepare to capture output of program `name` started at time.monotonic() `startTime`,
+        all output is also written to file path `spill` if given, each line prefixed with the time
+        it was read if timed (see TIME_FORMAT); the output is then handed over with consume() and close()
+        '''
+        self.startTime[name] = startTime
+        self.partial[name] = b""
+        self.lines[name] = collections.deque(maxlen=self.keepLines)
+        self.size[name] = 0
+        self.digests[name] = hashlib.blake2b(digest_size=16)
+        if spill:
+            self.spills[name] = open(spill, "wb")
+            if timed:
+                self.timedSpills.add(name)
+
+    def add(self, name, pipe, startTime, spill = None, timed = False):
+        '''
+        capture `pipe` (Popen.stdout) of program `name` on the thread of this capture, see track()
+        '''
+        self.track(name, startTime, spill, timed)
+        os.set_blocking(pipe.fileno(), False)
+        self.pipes[name] = pipe
+        self.selector.register(pipe.fileno(), selectors.EVENT_READ, name)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.pipes:
+            for key, _ in self.selector.select():
+                if key.data == None:
+                    # woken up by stop()
+                    for name in list(self.pipes):
+                        self.finish(name)
+                    return
+                self.read(key.data)
+
+    def read(self, name):
+        try:
+            data = os.read(self.pipes[name].fileno(), OutputCapture.CHUNK)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.finish(name)
+        elif not self.consume(name, data):
+            self.finish(name)
+            if self.onLimit:
+                self.onLimit(name)
+
+    def consume(self, name, data):
+        '''
+        take bytes `data` read from program `name`, return false iff it exceeded the limit
+        '''
+        if self.limit != None and self.size[name] + len(data) > self.limit:
+            data = data[:self.limit - self.size[name]]
+            self.exceeded.add(name)
+        self.size[name] += len(data)
+        if name in self.spills and name not in self.timedSpills:
+            self.spills[name].write(data)
+        now = time.monotonic() - self.startTime[name]
+        lines = (self.partial[name] + data).split(b"\n")
+        self.partial[name] = lines.pop()
+        for line in lines:
+            self.addLine(name, now, line)
+        return name not in self.exceeded
+
+    def addLine(self, name, now, line):
+        line = line.rstrip(b"\r")
+        self.lines[name].append((now, line))
+        if name in self.timedSpills:
+            self.spills[name].write(OutputCapture.TIME_FORMAT.format(now).encode() + line + b"\n")
+        # same normalization as executor.Comparator.digest in TOKEN mode
+        h = self.digests[name]
+        for token in line.split():
+            h.update(token)
+            h.update(b"\n")
+
+    def close(self, name):
+        '''
+        end the output of program `name`
+        '''
+        if self.partial[name]:
+            self.addLine(name, time.monotonic() - self.startTime[name], self.partial[name])
+            self.partial[name] = b""
+        if name in self.spills:
+            self.spills.pop(name).close()
+            self.timedSpills.discard(name)
+
+    def finish(self, name):
+        self.close(name)
+        pipe = self.pipes.pop(name)
+        self.selector.unregister(pipe.fileno())
+        pipe.close()
+
+    def join(self, timeout = None):
+        '''
+        wait until all pipes reach EOF, or stop capturing after timeout (in sec)
+        '''
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.stop()
+                self.thread.join()
+        self.selector.close()
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+    def stop(self):
+        os.write(self.wakeWrite, b"\0")
+
+    def getLines(self, name):
+        '''
+        return the list of captured lines of program `name`, decoded
+        '''
+        return [line.decode(errors="replace") for (t, line) in self.lines[name]]
+
+    def getTimedLines(self, name):
+        '''
+        return the list of (time, line) captured of program `name`
+        '''
+        return [(t, line.decode(errors="replace")) for (t, line) in self.lines[name]]
 
 class Feeder:
     #input Modes
@@ -18,20 +323,57 @@ class Feeder:
     FS_OK   = 0     #program ends normally
     FS_RE   = 1     #program ends with runtime error
     FS_TLE  = 2     #program couldn't end with in _timeOut
-    def __init__(self, _names, _runningOption, _inputMode, _input, _outputMode, _output, _timeOut = 1.0):
+    FS_OLE  = 3     #program wrote more than _outputLimit bytes
+    FS_MLE  = 4     #program's resident memory reached the "memory" of _limits
+    FS_NAMES = {FS_OK: "OK", FS_RE: "RE", FS_TLE: "TLE", FS_OLE: "OLE", FS_MLE: "MLE"}
+
+    # resident memory of running programs is checked this often (in sec), see watchMemory()
+    MEMORY_POLL = 0.05
+    # timed input is closed this long (in sec) after its last line
+    EOF_DELAY = 1.0
+    def __init__(self, _names, _runningOption, _inputMode, _input, _outputMode, _output, _timeOut = 1.0, _stallLimit = 5.0,
+                 _outputLimit = None, _keepLines = 10000, _limits = None, _timings = None, _launcher = None,
+                 _timedOutput = False):
         '''
         Feeder Constructor
         _names                      a list (or set) which contains all distinct participants
         _runningOption              a list of string, which will the argument for Popen()
         _inputMode
             IM_CLASSIC = 0          then _input is a file path, which will be redirected to all programs
-            IM_STRING = 1           then _input is the content of input file, which will be redirected as well
-            IM_TIMED_STRING = 2     then _input is a list of tuple, which has the format of (time, content)
+            IM_STRING = 1           then _input is the content of input file (str or bytes), which will be redirected as well
+            IM_TIMED_STRING = 2     then _input is a list of tuple, which has the format of (time, content),
+                                    or a timedinput.TimedInput
         _outputMode
             OM_CONSOLE = 0          then _output is None, and output will be displayed on the screen
             OM_CLASSIC = 1          then _output is a dict of name to file path, which will be redirected to for each programs
-            OM_STRING = 2           then _output is None, and output will be stored inside the class
+            OM_STRING = 2           then _output is None, and output will be stored inside the class; or _output is
+                                    a dict of name to file path, and all output will be also spilled into these files
         _timeOut = 1.0              longest time waiting for program to end (in sec)
+        _stallLimit = 5.0           longest time a program may leave its stdin pipe full before it
+                                    gets no more input (in sec), only used with IM_TIMED_STRING
+        _outputLimit = None         largest output of each program (in bytes), a program exceeding it is killed
+                                    and listed in self.outputExceeded; not used with OM_CONSOLE
+        _keepLines = 10000          number of last lines of each program kept in self.outputLines and
+                                    self.outputTimes; not used with OM_CONSOLE
+        _limits = None              a dict of resource limits applied to each program, where available:
+                                        "cpu"       cpu time (in sec)
+                                        "memory"    resident memory (in bytes), watched while the program
+                                                    runs, a program reaching it is killed (FS_MLE); the
+                                                    peak seen is kept in self.peakMemory, which is only
+                                                    known with this limit
+                                        "address"   address space (in bytes), allocations beyond it fail;
+                                                    a JVM reserves far more than its heap, so this must be
+                                                    well above -Xmx for Java participants
+                                        "processes" number of processes of the user
+        _timings = None             a stats.Timings which records the time of each stage (spawn, wait, collect),
+                                    the spawn latency and input delays of each program, see stats.Timings
+        _launcher = None            a launcher.Launcher which starts all programs of startAll() at the same
+                                    moment from its helper process; programs whose running option is not
+                                    a command are still started here
+        _timedOutput = False        if True, each line written into the files of _output is prefixed with the
+                                    time (in sec) it was read since the program started, as "[    1.2345]line"
+                                    like the timable-output jar prints it, so a SPJ can check the timing
+                                    of output; self.outputLines stays raw
         '''
         self.names = set(_names)
         self.runningOption = _runningOption
@@ -40,25 +382,89 @@ class Feeder:
         self.outputMode = _outputMode
         self.output = _output
         self.timeOut = _timeOut
+        self.stallLimit = _stallLimit
+        self.outputLimit = _outputLimit
+        self.keepLines = _keepLines
+        self.limits = _limits or dict()
+        self.timings = _timings if _timings else stats.Timings(False)
+        self.launcher = _launcher
+        self.timedOutput = _timedOutput
+        self.spawnLatency = dict()
 
         self.programs = dict()
         self.returnCode = dict()
         self.finishState = dict()
         self.outputLines = dict()
+        self.outputTimes = dict()
+        self.outputDigest = dict()
+        self.outputExceeded = set()
+        self.memoryExceeded = set()
+        self.capture = None
+        self.startTime = dict()
+        self.wallTime = dict()
+        self.cpuTime = dict()
+        self.peakMemory = dict()
+        self.inputDelay = dict()
+        self.inputStop = threading.Event()
+        self.writer = None
+        self.cutOff = set()
+        self.inputPath = None
+        self.inputFd = None
+        self.inputFile = None
 
-        if _inputMode == Feeder.IM_CLASSIC:
-            self.runningOption.append("<" + _input)
+
+    def prepareInput(self):
+        '''
+        make the input of IM_CLASSIC and IM_STRING available at self.inputPath, which every program
+        opens on its own. IM_STRING content is written once, into a sealed memfd where available,
+        otherwise into a read-only file in /dev/shm (or the temp directory)
+        '''
+        if self.inputPath != None:
+            return
+        if self.inputMode == Feeder.IM_CLASSIC:
+            self.inputPath = self.input
+        elif self.inputMode == Feeder.IM_STRING:
+            data = self.input.encode() if isinstance(self.input, str) else self.input
+            if hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd"):
+                sealing = fcntl != None and hasattr(fcntl, "F_ADD_SEALS")
+                fd = os.memfd_create("feeder-input", os.MFD_CLOEXEC | (os.MFD_ALLOW_SEALING if sealing else 0))
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if sealing:
+                    fcntl.fcntl(fd, fcntl.F_ADD_SEALS, fcntl.F_SEAL_WRITE | fcntl.F_SEAL_GROW | fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_SEAL)
+                self.inputFd = fd
+                # opening the fd through /proc gives a new file description, with its own offset
+                self.inputPath = "/proc/self/fd/{}".format(fd)
+            else:
+                d = "/dev/shm" if os.path.isdir("/dev/shm") else None
+                with tempfile.NamedTemporaryFile(dir=d, delete=False) as f:
+                    f.write(data)
+                os.chmod(f.name, 0o444)
+                self.inputFile = f.name
+                self.inputPath = f.name
+
+    def releaseInput(self):
+        '''
+        drop the input made by prepareInput(), programs already started keep their own descriptors
+        '''
+        if self.inputFd != None:
+            os.close(self.inputFd)
+            self.inputFd = None
+        if self.inputFile != None:
+            os.remove(self.inputFile)
+            self.inputFile = None
+        self.inputPath = None
 
     def getStdin(self):
         '''
-        return the parameter to Popen.stdin
+        return the parameter to Popen.stdin, for IM_CLASSIC and IM_STRING it is a new read-only
+        descriptor of the input, which the caller closes once the program is started
         '''
         ipt = None
-        if self.inputMode == Feeder.IM_STRING:
-            ipt = tempfile.NamedTemporaryFile()
-            ipt.write(self.input)
-            ipt.flush()
-            ipt.seek(0)
+        if self.inputMode == Feeder.IM_CLASSIC or self.inputMode == Feeder.IM_STRING:
+            self.prepareInput()
+            ipt = os.open(self.inputPath, os.O_RDONLY)
         elif self.inputMode == Feeder.IM_TIMED_STRING:
             ipt = sp.PIPE
         return ipt
@@ -68,10 +474,175 @@ class Feeder:
         return the parameter to Popen.stdout
         '''
         opt = None
-        if self.outputMode == Feeder.OM_STRING:
-            opt = tempfile.NamedTemporaryFile()
+        if self.outputMode == Feeder.OM_STRING or self.outputMode == Feeder.OM_CLASSIC:
+            opt = sp.PIPE
         return opt
 
+    def getCapture(self):
+        '''
+        return a new OutputCapture for this output mode, or None if output is not captured
+        '''
+        if self.getStdout() != sp.PIPE:
+            return None
+        return OutputCapture(self.outputLimit, self.keepLines, self.onOutputLimit)
+
+    def onOutputLimit(self, name):
+        self.outputExceeded.add(name)
+        self.kill(name)
+
+    def kill(self, name):
+        '''
+        kill program `name` without reaping it, reap() collects it afterwards
+        '''
+        p = self.programs[name]
+        if p.returncode != None:
+            return
+        if isinstance(p, sp.Popen) and hasattr(signal, "SIGKILL"):
+            # Popen.kill() would poll() and reap the program before os.wait4 could
+            os.kill(p.pid, signal.SIGKILL)
+        else:
+            p.kill()
+
+    @staticmethod
+    def residentPeak(pid):
+        '''
+        return the peak resident memory (in bytes) of running process pid so far, or None if unknown
+        '''
+        try:
+            with open("/proc/{}/status".format(pid), "rb") as f:
+                for line in f:
+                    if line.startswith(b"VmHWM:"):
+                        # in kB
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def pollTimeout(self, remain):
+        '''
+        return how long waiting for programs may block before watchMemory() is due
+        '''
+        return min(remain, Feeder.MEMORY_POLL) if "memory" in self.limits else remain
+
+    def watchMemory(self, lst):
+        '''
+        sample the resident memory of programs in lst into self.peakMemory, and kill those which
+        reached the "memory" limit, they finish with FS_MLE
+        '''
+        if "memory" not in self.limits:
+            return
+        for name in lst:
+            p = self.programs[name]
+            if name in self.memoryExceeded or p.returncode != None or getattr(p, "pid", None) == None:
+                continue
+            peak = Feeder.residentPeak(p.pid)
+            if peak == None:
+                continue
+            self.peakMemory[name] = max(peak, self.peakMemory.get(name) or 0)
+            if peak >= self.limits["memory"]:
+                self.memoryExceeded.add(name)
+                self.kill(name)
+
+    def spawn(self, name, opt):
+        '''
+        start program `name`, its output is handed to self.capture if there is one
+        the running option of `name` is either a command or an object which starts the program itself
+        with launch(stdin, stdout, limits) and returns a Popen-like object, see warm.WarmJava
+        '''
+        ro = self.runningOption[name]
+        begin = time.perf_counter()
+        ipt = self.getStdin()
+        try:
+            if hasattr(ro, "launch"):
+                p = ro.launch(ipt, opt, self.limits)
+            else:
+                p = rlimits.popen(ro, self.limits, stdin = ipt, stdout = opt)
+        finally:
+            if isinstance(ipt, int) and ipt >= 0:
+                os.close(ipt)
+        self.spawnLatency[name] = time.perf_counter() - begin
+        self.timings.record("spawn.program", self.spawnLatency[name])
+        self.programs[name] = p
+        self.startTime[name] = time.monotonic()
+        if self.capture:
+            spill = self.output[name] if self.output else None
+            self.capture.add(name, p.stdout, self.startTime[name], spill, self.timedOutput)
+        return p
+
+    def launchAll(self, lst, opt):
+        '''
+        start programs in lst at the same moment with self.launcher, their output is handed to
+        self.capture if there is one
+        '''
+        (programs, parentEnds, childEnds) = ([], [], [])
+        try:
+            for name in lst:
+                ipt = self.getStdin()
+                (stdin, stdout) = (None, None)
+                if ipt == sp.PIPE:
+                    (r, w) = os.pipe()
+                    childEnds.append(r)
+                    stdin = open(w, "wb")
+                    parentEnds.append(stdin)
+                    ipt = r
+                elif ipt != None:
+                    childEnds.append(ipt)
+                out = None
+                if opt == sp.PIPE:
+                    (r, w) = os.pipe()
+                    childEnds.append(w)
+                    stdout = open(r, "rb")
+                    parentEnds.append(stdout)
+                    out = w
+                programs.append(((stdin, stdout), (self.runningOption[name], ipt, out, self.limits)))
+            (processes, latency, start) = self.launcher.launch([request for (ends, request) in programs])
+        except:
+            for f in parentEnds:
+                f.close()
+            raise
+        finally:
+            for fd in childEnds:
+                os.close(fd)
+        for (name, ((stdin, stdout), request), p, lat) in zip(lst, programs, processes, latency):
+            (p.stdin, p.stdout) = (stdin, stdout)
+            self.programs[name] = p
+            self.startTime[name] = start
+            self.spawnLatency[name] = lat
+            self.timings.record("spawn.program", lat)
+            if self.capture:
+                spill = self.output[name] if self.output else None
+                self.capture.add(name, p.stdout, start, spill, self.timedOutput)
+
+    def collectOutput(self):
+        '''
+        wait for self.capture to read all output, then move what it captured into this feeder
+        '''
+        if not self.capture:
+            return
+        # programs are dead by now, only their own children may still hold the pipes
+        self.capture.join(1.0)
+        for name in self.capture.lines:
+            self.outputLines[name] = self.capture.getLines(name)
+            self.outputTimes[name] = self.capture.getTimedLines(name)
+            self.outputDigest[name] = self.capture.digests[name].hexdigest()
+        self.capture = None
+
+    def recordRound(self, lst):
+        '''
+        hand the input delays and finish states of programs in lst over to self.timings
+        '''
+        if not self.timings.enabled:
+            return
+        self.timings.count("programs", len(lst))
+        for name in lst:
+            for delay in self.inputDelay.get(name, []):
+                self.timings.record("feed", delay)
+            state = self.finishState.get(name, Feeder.FS_OK)
+            if state != Feeder.FS_OK:
+                self.timings.count("finish.{}".format(Feeder.FS_NAMES.get(state, state)))
+            if name in self.cutOff:
+                self.timings.count("cutOff")
+
     def allFinished(self, lst = None):
         '''
         return true iff all programs have finished running (no matter how)
@@ -83,6 +654,110 @@ class Feeder:
                 return False
         return True
 
+    def waitAll(self, lst = None, timeOut = None):
+        '''
+        block until every program in lst has exited or timeOut (in sec) has passed since now,
+        whichever comes first; the wall time of each exited program is recorded in self.wallTime.
+        child exit is observed through pidfd and selectors where available, otherwise by one
+        waiting thread per program, so this returns as soon as the last program exits.
+        return the list of programs which are still running
+        '''
+        if not lst:
+            lst = self.names
+        if timeOut == None:
+            timeOut = self.timeOut
+        deadline = time.monotonic() + timeOut
+        running = [name for name in lst if name not in self.wallTime]
+        # programs started by a launcher may have no process of their own to watch
+        if hasattr(os, "pidfd_open") and all(isinstance(self.programs[name], sp.Popen) for name in running):
+            running = self._waitPidfd(running, deadline)
+        else:
+            running = self._waitThreads(running, deadline)
+        return running
+
+    def _recordExit(self, name):
+        self.wallTime[name] = time.monotonic() - self.startTime[name]
+
+    def reap(self, name):
+        '''
+        wait for program `name` to exit, collecting its cpu time where os.wait4 exists.
+        ru_maxrss is not taken as its peak memory: a program spawned from this process counts the
+        resident size of this process before exec, see watchMemory() instead
+        '''
+        p = self.programs[name]
+        if p.returncode != None:
+            return
+        if not isinstance(p, sp.Popen) or not hasattr(os, "wait4"):
+            p.wait()
+            # programs started by a launcher are reaped by its helper, see launcher.LaunchedProcess
+            if getattr(p, "cpuTime", None) != None:
+                self.cpuTime[name] = p.cpuTime
+            return
+        try:
+            (pid, status, usage) = os.wait4(p.pid, 0)
+        except ChildProcessError:
+            # already reaped by Popen itself
+            p.wait()
+            return
+        p.returncode = os.waitstatus_to_exitcode(status)
+        self.cpuTime[name] = usage.ru_utime + usage.ru_stime
+
+    def _waitPidfd(self, lst, deadline):
+        sel = selectors.DefaultSelector()
+        running = set()
+        for name in lst:
+            p = self.programs[name]
+            try:
+                fd = os.pidfd_open(p.pid)
+            except ProcessLookupError:
+                # already reaped
+                self.reap(name)
+                self._recordExit(name)
+                continue
+            sel.register(fd, selectors.EVENT_READ, name)
+            running.add(name)
+        try:
+            while running:
+                remain = deadline - time.monotonic()
+                if remain <= 0:
+                    break
+                for key, _ in sel.select(self.pollTimeout(remain)):
+                    name = key.data
+                    self._recordExit(name)
+                    sel.unregister(key.fd)
+                    os.close(key.fd)
+                    self.reap(name)
+                    running.discard(name)
+                self.watchMemory(running)
+        finally:
+            for key in list(sel.get_map().values()):
+                os.close(key.fd)
+            sel.close()
+        return [name for name in lst if name in running]
+
+    def _waitThreads(self, lst, deadline):
+        exited = queue.Queue()
+        def waiter(name):
+            self.reap(name)
+            # a launcher reports when the program really exited
+            end = getattr(self.programs[name], "end", None)
+            exited.put((name, end if end != None else time.monotonic()))
+        running = set(lst)
+        for name in lst:
+            threading.Thread(target=waiter, args=[name], daemon=True).start()
+        while running:
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                break
+            try:
+                (name, end) = exited.get(timeout=self.pollTimeout(remain))
+            except queue.Empty:
+                self.watchMemory(running)
+                continue
+            self.wallTime[name] = end - self.startTime[name]
+            running.discard(name)
+        return [name for name in lst if name in running]
+
     def killAll(self, lst = None):
         '''
         terminate each program in lst, if it is not finished yet;
@@ -92,14 +767,35 @@ class Feeder:
             lst = self.names
         for name in lst:
             p = self.programs[name]
-            if p.poll() == None:
-                p.kill()
-                self.finishState = Feeder.FS_TLE
-            self.returnCode[name] = p.poll()
-            if p.poll() == 0:
-                self.finishState = Feeder.FS_OK
-            else:
-                self.finishState = Feeder.FS_RE
+            killed = False
+            if name not in self.wallTime:
+                # still running after waitAll()
+                self.kill(name)
+                self.reap(name)
+                self._recordExit(name)
+                killed = True
+            self.returnCode[name] = p.returncode
+            self.finishState[name] = self.getFinishState(name, killed)
+
+    def getFinishState(self, name, killed = False):
+        '''
+        return the finish state of program `name`, which has exited
+        '''
+        code = self.returnCode[name]
+        if name in self.outputExceeded:
+            return Feeder.FS_OLE
+        if name in self.memoryExceeded:
+            return Feeder.FS_MLE
+        if killed:
+            return Feeder.FS_TLE
+        if code == 0:
+            return Feeder.FS_OK
+        if "cpu" in self.limits:
+            if hasattr(signal, "SIGXCPU") and code == -signal.SIGXCPU:
+                return Feeder.FS_TLE
+            if code == -signal.SIGKILL and (self.cpuTime.get(name) or 0.0) >= self.limits["cpu"]:
+                return Feeder.FS_TLE
+        return Feeder.FS_RE
 
     def finishInput(self, lst = None):
         '''
@@ -107,103 +803,160 @@ class Feeder:
         '''
         if not lst:
             lst = self.names
+        if self.writer:
+            self.writer.close(lst)
+            return
         for name in lst:
             p = self.programs[name]
-            if p.poll() == None:
+            if p.returncode == None:
                 p.stdin.close()
 
-    def feedAll(self, line, lst = None):
+    def feedAll(self, line, lst = None, scheduled = None):
         '''
-        feed the string `line` to programs in list `lst`
+        feed the string `line` to programs in list `lst`, the line is encoded only once and
+        written without blocking, see FanoutWriter
+        if `scheduled` (a time.monotonic() value) is given, the delay of this delivery is
+        appended to self.inputDelay of each program
         '''
         if not lst:
             lst = self.names
-        for name in lst:
-            p = self.programs[name]
-            if p.poll() == None:
-                p.stdin.write((line+"\n").encode())
-                p.stdin.flush()
+        if not self.writer:
+            self.writer = FanoutWriter({name: self.programs[name].stdin for name in lst}, self.stallLimit)
+            self.inputDelay = self.writer.delays
+        self.writer.write((line+"\n").encode(), lst, scheduled)
+
+    def waitInput(self, until):
+        '''
+        wait until time.monotonic() reaches `until`, meanwhile keep pending input flowing
+        return true iff self.inputStop is set in the meantime
+        '''
+        while True:
+            now = time.monotonic()
+            if self.inputStop.is_set():
+                return True
+            if now >= until:
+                return False
+            if self.writer and self.writer.pending():
+                # check inputStop at least every 0.1 sec while some pipe is still backed up
+                self.writer.pump(min(until, now + 0.1))
+                self.cutOff |= self.writer.cutOff
+            else:
+                return self.inputStop.wait(until - now)
 
-    def getInputTimers(self, lst = None):
+    def feedTimed(self, lst = None):
         '''
-        return a list of timers of all timed input described in self.input
+        deliver all timed input described in self.input to programs in list `lst`, then feed EOF
+        EOF_DELAY seconds after the last line; lines sharing the same time are written as a single batch.
+        this runs on one thread and stops early once self.inputStop is set
         '''
-        ret = []
+        if not lst:
+            lst = self.names
+        self.writer = FanoutWriter({name: self.programs[name].stdin for name in lst}, self.stallLimit)
+        self.inputDelay = self.writer.delays
+        batches = timedinput.TimedInput.of(self.input).batches()
         maxtim = 0.0
-        for pair in self.input:
-            maxtim = max(maxtim, pair[0])
-            timer = threading.Timer(pair[0], self.feedAll, [pair[1], lst])
-            ret.append(timer)
-        ret.append(threading.Timer(maxtim+1.0, self.finishInput, [lst]))
-        return ret
+        base = time.monotonic()
+        try:
+            for (tim, data) in batches:
+                scheduled = base + tim
+                if self.waitInput(scheduled):
+                    return
+                self.writer.write(data, lst, scheduled)
+                maxtim = tim
+            if self.waitInput(base + maxtim + Feeder.EOF_DELAY):
+                return
+            self.finishInput(lst)
+            while self.writer.pending():
+                if self.waitInput(time.monotonic() + self.stallLimit):
+                    return
+        finally:
+            self.cutOff |= self.writer.cutOff
+            self.writer.closeAll()
+            self.writer = None
+
+    def getInputScheduler(self, lst = None):
+        '''
+        return a thread which delivers all timed input described in self.input
+        '''
+        self.inputStop.clear()
+        return threading.Thread(target=self.feedTimed, args=[lst], daemon=True)
 
     def startAll(self):
         '''
         start all programs at the same time, all programs will be running parallelly
         '''
-        # print("startall")
-        ro = self.runningOption
-        ipt = self.getStdin()
         opt = self.getStdout()
-        timers = []
+        self.capture = self.getCapture()
+        scheduler = None
         # initialize parameters for this IO mode
         if self.inputMode == Feeder.IM_TIMED_STRING:
-            timers = self.getInputTimers()
-        print("input timers got")
+            scheduler = self.getInputScheduler()
         # run all programs
-        print(self.names)
-        for name in self.names:
-            print(name)
-            if self.outputMode == Feeder.OM_CLASSIC:
-                ro = self.runningOption[name]
-                opt = open(self.output[name], "w")
-            else:
-                ro = self.runningOption[name]
-            print(ro)
-            p = sp.Popen(ro, stdin = ipt, stdout = opt)
-            self.programs[name] = p
-        startTime = time.time()
+        debug = log.isEnabledFor(logging.DEBUG)
+        with self.timings.stage("spawn"):
+            launched = []
+            if self.launcher:
+                launched = [name for name in sorted(self.names) if not hasattr(self.runningOption[name], "launch")]
+                if launched:
+                    self.launchAll(launched, opt)
+            for name in self.names:
+                if name in launched:
+                    continue
+                if debug:
+                    log.debug("starting %s: %s", name, self.runningOption[name])
+                self.spawn(name, opt)
+        # programs started by the launcher are all released at the same moment
+        if len(self.startTime) > 1 and len(launched) < len(self.names):
+            self.timings.record("spawn.skew", max(self.startTime.values()) - min(self.startTime.values()))
+        self.releaseInput()
         
-        # start all timers
-        for timer in timers:
-            timer.start()
+        # start delivering timed input and capturing output
+        if scheduler:
+            scheduler.start()
+        if self.capture:
+            self.capture.start()
         
         # wait until all programs are finished or time out
-        while time.time()-startTime < self.timeOut:
-            if self.allFinished():
-                break
-            time.sleep(min(1.0, self.timeOut/100.0))
+        with self.timings.stage("wait"):
+            self.waitAll()
         
         # now all programs are finished, or needs to be finished
-        self.killAll()
+        with self.timings.stage("collect"):
+            self.killAll()
+            if scheduler:
+                self.inputStop.set()
+                scheduler.join()
+            self.collectOutput()
+        self.recordRound(self.names)
 
     def runAll(self):
         '''
         run all programs one by one, each program will be running seperatedly
         '''
-        ro = self.runningOption
-        ipt = self.getStdin()
         opt = self.getStdout()
-        timers = []
+        scheduler = None
 
         # run all programs one by one
         for name in self.names:
-            if self.outputMode == Feeder.OM_CLASSIC:
-                ro = self.runningOption + ["1>" + self.output[name]]
-            else:
-                ro = self.runningOption
             # initialize parameters for this IO mode
             if self.inputMode == Feeder.IM_TIMED_STRING:
-                timers = self.getInputTimers([name])
-            p = sp.Popen(ro, stdin = ipt, stdout = opt)
-            self.programs[name] = p
-            start_time = time.time()
-            # start all timers
-            for timer in timers:
-                timer.start()
+                scheduler = self.getInputScheduler([name])
+            self.capture = self.getCapture()
+            with self.timings.stage("spawn"):
+                self.spawn(name, opt)
+            # start delivering timed input and capturing output
+            if scheduler:
+                scheduler.start()
+            if self.capture:
+                self.capture.start()
             # wait until the program is finished or time out
-            while time.time()-start_time < self.timeOut:
-                if self.allFinished([name]):
-                    break
-                time.sleep(min(1.0, self.timeOut/100.0))
-            self.killAll([name])
+            with self.timings.stage("wait"):
+                self.waitAll([name])
+            with self.timings.stage("collect"):
+                self.killAll([name])
+                if scheduler:
+                    self.inputStop.set()
+                    scheduler.join()
+                self.collectOutput()
+            self.recordRound([name])
+        self.releaseInput()
@@ -0,0 +1,115 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.util.HashSet;
+import java.util.Properties;
+import java.util.Set;
+
+/**
+ * Keeps one JVM for one participant and runs its main class once per case.
+ *
+ * usage: java -cp <dir of this class> OjHarness <main class> <classpath entry>...
+ *
+ * The harness prints "PORT <port>" on stdout, then for each line "RUN" read from stdin it
+ * accepts two connections on that port, the first one is the stdin of the case and the second
+ * one its stdout. Classes of the participant and its dependencies are loaded by a new class
+ * loader for every case, so their static state starts fresh. Once all non-daemon threads of the
+ * case have finished, "EXIT <code> <leaked>" is printed, leaked is 1 if the case left threads
+ * running or changed system properties, in which case the JVM should not be reused.
+ */
+public class OjHarness {
+    public static void main(String[] args) throws Exception {
+        String mainClass = args[0];
+        URL[] urls = new URL[args.length - 1];
+        for (int i = 1; i < args.length; i++) {
+            urls[i - 1] = new File(args[i]).toURI().toURL();
+        }
+        InputStream origIn = System.in;
+        final PrintStream origErr = System.err;
+        PrintStream reply = System.out;
+        BufferedReader control = new BufferedReader(new InputStreamReader(origIn));
+        ServerSocket server = new ServerSocket(0, 2, InetAddress.getLoopbackAddress());
+        reply.println("PORT " + server.getLocalPort());
+        reply.flush();
+        Properties props = (Properties) System.getProperties().clone();
+
+        String line;
+        while ((line = control.readLine()) != null) {
+            if (!line.equals("RUN")) {
+                continue;
+            }
+            Socket in = server.accept();
+            Socket out = server.accept();
+            Set<Thread> before = new HashSet<Thread>(Thread.getAllStackTraces().keySet());
+            final URLClassLoader loader = new URLClassLoader(urls, ClassLoader.getPlatformClassLoader());
+            final int[] code = {0};
+            ThreadGroup group = new ThreadGroup("case") {
+                @Override
+                public void uncaughtException(Thread t, Throwable e) {
+                    e.printStackTrace(origErr);
+                    code[0] = 1;
+                }
+            };
+            PrintStream caseOut = new PrintStream(new BufferedOutputStream(out.getOutputStream()), true);
+            System.setIn(new BufferedInputStream(in.getInputStream()));
+            System.setOut(caseOut);
+            Thread runner = new Thread(group, new Runnable() {
+                public void run() {
+                    try {
+                        Class<?> c = Class.forName(mainClass, true, loader);
+                        Method m = c.getMethod("main", String[].class);
+                        m.invoke(null, (Object) new String[0]);
+                    } catch (InvocationTargetException e) {
+                        e.getCause().printStackTrace(origErr);
+                        code[0] = 1;
+                    } catch (Throwable e) {
+                        e.printStackTrace(origErr);
+                        code[0] = 1;
+                    }
+                }
+            }, "main");
+            runner.setContextClassLoader(loader);
+            runner.start();
+            runner.join();
+            // the case ends when all of its non-daemon threads have ended
+            boolean alive = true;
+            while (alive) {
+                alive = false;
+                Thread[] threads = new Thread[group.activeCount() + 16];
+                int n = group.enumerate(threads, true);
+                for (int i = 0; i < n; i++) {
+                    if (!threads[i].isDaemon() && threads[i].isAlive()) {
+                        threads[i].join();
+                        alive = true;
+                    }
+                }
+            }
+            caseOut.flush();
+            System.setIn(origIn);
+            System.setOut(reply);
+            boolean leaked = !System.getProperties().equals(props);
+            for (Thread t : Thread.getAllStackTraces().keySet()) {
+                if (t.isAlive() && !before.contains(t)) {
+                    leaked = true;
+                }
+            }
+            out.shutdownOutput();
+            out.close();
+            in.close();
+            loader.close();
+            reply.println("EXIT " + code[0] + " " + (leaked ? 1 : 0));
+            reply.flush();
+        }
+    }
+}
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import socket
+import threading
+import subprocess as sp
+import rlimits
+
+# run by every program in the helper: wait at the barrier (fd 3) until all programs of the round
+# are spawned, then become the program
+WRAPPER = 'read _ <&3; exec "$@" 3<&-'
+SHELL = "/bin/sh"
+
+def helperMain(fd):
+    '''
+    the helper process: spawn programs on request of the Launcher connected to socket fd, and
+    report their exit, with cpu time
+    '''
+    # nothing the helper holds may leak into the programs
+    os.set_inheritable(fd, False)
+    sock = socket.socket(fileno=fd)
+    sendLock = threading.Lock()
+    children = threading.Condition()
+    pending = [0]
+
+    def send(msg):
+        with sendLock:
+            sock.send(json.dumps(msg).encode())
+
+    def reaper():
+        while True:
+            with children:
+                while pending[0] == 0:
+                    children.wait()
+            try:
+                (pid, status, usage) = os.wait4(-1, 0)
+            except ChildProcessError:
+                with children:
+                    pending[0] = 0
+                continue
+            end = time.monotonic()
+            with children:
+                pending[0] -= 1
+            # ru_maxrss is not sent, it counts the resident size of the helper before exec
+            send({"exit": pid, "code": os.waitstatus_to_exitcode(status), "end": end,
+                  "cpu": usage.ru_utime + usage.ru_stime})
+
+    threading.Thread(target=reaper, daemon=True).start()
+    while True:
+        (msg, fds, flags, addr) = socket.recv_fds(sock, 1 << 20, 1024)
+        if not msg:
+            break
+        for f in fds:
+            os.set_inheritable(f, False)
+        request = json.loads(msg)
+        (barrier, release) = os.pipe()
+        (pids, latency, errors) = ([], [], [])
+        try:
+            for program in request["programs"]:
+                actions = []
+                for (target, key) in ((0, "stdin"), (1, "stdout")):
+                    if program[key] != None:
+                        actions.append((os.POSIX_SPAWN_DUP2, fds[program[key]], target))
+                # last, a received descriptor may be 3 itself
+                actions.append((os.POSIX_SPAWN_DUP2, barrier, 3))
+                begin = time.monotonic()
+                try:
+                    pid = os.posix_spawn(SHELL, ["sh", "-c", WRAPPER, "sh"] + program["argv"], os.environ, file_actions=actions)
+                except OSError as e:
+                    pid = None
+                    errors.append(str(e))
+                else:
+                    with children:
+                        pending[0] += 1
+                        children.notify()
+                    try:
+                        rlimits.apply(pid, program["limits"])
+                    except (OSError, ValueError) as e:
+                        # reported, the Launcher kills the whole round
+                        errors.append(str(e))
+                pids.append(pid)
+                latency.append(time.monotonic() - begin)
+        finally:
+            for f in fds:
+                os.close(f)
+            os.close(barrier)
+            start = time.monotonic()
+            # all programs leave the barrier at once
+            os.close(release)
+        send({"pids": pids, "latency": latency, "start": start, "errors": errors})
+
+class LaunchedProcess:
+    '''
+    Class LaunchedProcess
+    a program started by a Launcher, it offers what Feeder uses of a Popen object;
+    self.cpuTime is its cpu time once it exited
+    '''
+    def __init__(self, pid, stdin = None, stdout = None):
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.returncode = None
+        self.cpuTime = None
+        self.end = None
+        self.done = threading.Event()
+
+    def finish(self, msg):
+        self.cpuTime = msg["cpu"]
+        self.end = msg["end"]
+        self.returncode = msg["code"]
+        self.done.set()
+
+    def wait(self, timeout = None):
+        self.done.wait(timeout)
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.returncode == None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+class Launcher:
+    '''
+    Class Launcher
+    in charge of a small helper process, started once from a fresh interpreter, which starts all
+    programs of a round with os.posix_spawn. every program waits at a barrier until the last one is
+    spawned, so all of them begin at the same moment however large this process is; the spawn
+    latency of each program is measured in the helper. programs are children of the helper, which
+    reaps them and reports their exit code and cpu time.
+    only available where os.posix_spawn and socket.send_fds exist, see available()
+    '''
+    def __init__(self):
+        self.process = None
+        self.sock = None
+        self.lock = threading.Lock()
+        self.stateLock = threading.Lock()
+        self.replies = queue.Queue()
+        self.processes = dict()
+        self.exits = dict()
+
+    def __getstate__(self):
+        # the helper belongs to the process which started it
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @staticmethod
+    def available():
+        return hasattr(os, "posix_spawn") and hasattr(socket, "send_fds") and os.path.exists(SHELL)
+
+    def start(self):
+        if self.process != None and self.process.poll() == None:
+            return
+        (parent, child) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # -S: no site packages, the helper stays small
+        self.process = sp.Popen([sys.executable, "-S", os.path.abspath(__file__), str(child.fileno())],
+                                pass_fds=[child.fileno()])
+        child.close()
+        self.sock = parent
+        threading.Thread(target=self.read, args=[parent], daemon=True).start()
+
+    def close(self):
+        if self.process != None:
+            self.sock.shutdown(socket.SHUT_RDWR)
+            self.sock.close()
+            self.process.wait()
+            self.process = None
+
+    def read(self, sock):
+        while True:
+            try:
+                msg = sock.recv(1 << 20)
+            except OSError:
+                msg = b""
+            if not msg:
+                break
+            msg = json.loads(msg)
+            if "exit" in msg:
+                with self.stateLock:
+                    p = self.processes.pop(msg["exit"], None)
+                    if p == None:
+                        # exited before launch() got its pid
+                        self.exits[msg["exit"]] = msg
+                if p != None:
+                    p.finish(msg)
+            else:
+                self.replies.put(msg)
+        # the helper is gone, its programs can't be reported any more
+        self.replies.put(None)
+        with self.stateLock:
+            (processes, self.processes) = (self.processes, dict())
+        for p in processes.values():
+            p.finish({"cpu": None, "memory": None, "end": time.monotonic(), "code": -signal.SIGKILL})
+
+    def launch(self, programs):
+        '''
+        start all programs at the same time, programs is a list of (argv, stdin, stdout, limits),
+        where stdin and stdout are file descriptors or None (inherited from the helper).
+        return (processes, latency, start): the LaunchedProcess and the spawn latency (in sec)
+        of each program, and the time.monotonic() at which all of them were released
+        '''
+        with self.lock:
+            self.start()
+            (fds, request) = ([], [])
+            for (argv, stdin, stdout, limits) in programs:
+                entry = {"argv": list(argv), "limits": limits, "stdin": None, "stdout": None}
+                for (key, fd) in (("stdin", stdin), ("stdout", stdout)):
+                    if fd != None:
+                        entry[key] = len(fds)
+                        fds.append(fd)
+                request.append(entry)
+            socket.send_fds(self.sock, [json.dumps({"programs": request}).encode()], fds)
+            reply = self.replies.get()
+        if reply == None:
+            raise OSError("launcher helper exited")
+        processes = []
+        for pid in reply["pids"]:
+            if pid == None:
+                processes.append(None)
+                continue
+            p = LaunchedProcess(pid)
+            with self.stateLock:
+                msg = self.exits.pop(pid, None)
+                if msg == None:
+                    self.processes[pid] = p
+            if msg != None:
+                p.finish(msg)
+            processes.append(p)
+        if reply["errors"]:
+            for p in processes:
+                if p != None:
+                    p.kill()
+            raise OSError("; ".join(reply["errors"]))
+        return (processes, reply["latency"], reply["start"])
+
+if __name__ == "__main__":
+    helperMain(int(sys.argv[1]))
@@ -1,11 +1,24 @@
 import os
-import glob
 import copy
 import subprocess as sp
 import tempfile
 import re
 import time
 import random
+import threading
+import queue
+import hashlib
+import shutil
+import concurrent.futures as cf
+import struct
+import json
+import sqlite3
+import csv
+import logging
+import warm
+from timedinput import TimedInput
+
+log = logging.getLogger(__name__)
 
 def allFilesUnder(path, pattern=".*"):
     ret = []
@@ -16,6 +29,181 @@ def allFilesUnder(path, pattern=".*"):
                 ret += [os.path.join(i[0], j)]
     return ret
 
+def filesWithExt(path, ext, manifest = None):
+    '''
+    return all files under path with extension ext (without dot), taken from manifest if given
+    '''
+    if manifest:
+        return manifest.allFiles(ext)
+    return allFilesUnder(path, r".*\." + re.escape(ext))
+
+class Manifest:
+    '''
+    Class Manifest
+    in charge of recording all files under one participant's directory, with their sizes,
+    mtimes and content hashes. scan() walks the directory once with os.scandir and only hashes
+    files whose size or mtime changed since the previous scan
+    '''
+    def __init__(self, _root, _files = None):
+        '''
+        _files is a dict of relative path to [size, mtime, hash], as returned by toDict()
+        '''
+        self.root = os.path.abspath(_root)
+        self.files = dict(_files) if _files else dict()
+
+    @staticmethod
+    def hashFile(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def scan(self):
+        '''
+        refresh the manifest, return the set of relative paths added, modified or removed
+        '''
+        files = dict()
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        rel = os.path.relpath(entry.path, self.root)
+                        st = entry.stat()
+                        old = self.files.get(rel)
+                        if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                            files[rel] = old
+                        else:
+                            files[rel] = [st.st_size, st.st_mtime_ns, Manifest.hashFile(entry.path)]
+        changed = {rel for rel in files if self.files.get(rel) != files[rel]}
+        changed |= set(self.files) - set(files)
+        self.files = files
+        return changed
+
+    def allFiles(self, ext = None):
+        '''
+        return absolute paths of all files, or only of those with extension ext (without dot)
+        '''
+        ret = []
+        for rel in sorted(self.files):
+            if ext == None or os.path.splitext(rel)[1].lower()[1:] == ext.lower():
+                ret.append(os.path.join(self.root, rel))
+        return ret
+
+    def extensions(self):
+        return {os.path.splitext(rel)[1].lower()[1:] for rel in self.files}
+
+    def sourceDigest(self):
+        '''
+        return a hash of the paths and contents of all files except compiled artifacts
+        '''
+        h = hashlib.sha256()
+        for rel in sorted(self.files):
+            if not CompileCache.isArtifact(rel):
+                h.update("{}\0{}\0".format(rel, self.files[rel][2]).encode())
+        return h.hexdigest()
+
+    def toDict(self):
+        return self.files
+
+class CompileCache:
+    '''
+    Class CompileCache
+    in charge of keeping compiled artifacts of participants, keyed by the hash of their sources,
+    the compiler command and the dependencies; least recently used entries are evicted once the
+    cache grows over maxSize bytes
+    '''
+    ARTIFACT_EXT = {"class", "o"}
+
+    def __init__(self, _path, _maxSize = 1 << 30):
+        self.path = os.path.abspath(_path)
+        self.maxSize = _maxSize
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def isArtifact(filename):
+        return os.path.splitext(filename)[1].lower()[1:] in CompileCache.ARTIFACT_EXT
+
+    def key(self, partiPath, cmd, deps = [], manifest = None):
+        h = hashlib.sha256()
+        h.update(cmd.encode())
+        for dep in deps:
+            h.update(b"\0dep\0" + dep.encode())
+            if os.path.isfile(dep):
+                st = os.stat(dep)
+                h.update("{}:{}".format(st.st_size, st.st_mtime_ns).encode())
+        if manifest:
+            h.update(manifest.sourceDigest().encode())
+            return h.hexdigest()
+        for fi in sorted(allFilesUnder(partiPath)):
+            if CompileCache.isArtifact(fi):
+                continue
+            h.update(b"\0file\0" + os.path.relpath(fi, partiPath).encode())
+            with open(fi, "rb") as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def restore(self, key, partiPath):
+        '''
+        copy the artifacts stored under key into partiPath, return false if there are none
+        '''
+        entry = os.path.join(self.path, key)
+        if not os.path.isdir(entry):
+            return False
+        for fi in allFilesUnder(entry):
+            target = os.path.join(partiPath, os.path.relpath(fi, entry))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(fi, target)
+        # mtime of the entry marks its last use
+        os.utime(entry)
+        return True
+
+    def store(self, key, partiPath, files):
+        '''
+        store files (paths under partiPath) as the artifacts of key
+        '''
+        entry = os.path.join(self.path, key)
+        tmp = entry + ".tmp{}".format(threading.get_ident())
+        for fi in files:
+            target = os.path.join(tmp, os.path.relpath(fi, partiPath))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(fi, target)
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored by someone else in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for d in os.scandir(self.path):
+                if d.is_dir() and ".tmp" not in d.name:
+                    size = sum(os.path.getsize(fi) for fi in allFilesUnder(d.path))
+                    entries.append((d.stat().st_mtime, size, d.path))
+                    total += size
+            for (mtime, size, path) in sorted(entries):
+                if total <= self.maxSize:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
 class Runner:
     '''
     Class Runner
@@ -35,13 +223,33 @@ class Runner:
         }
 
     JAVA_MC_PAT = "public static void main(java.lang.String[])"
+    JAVA_MC_SRC_PAT = re.compile(r"public\s+static\s+void\s+main\s*\(\s*(final\s+)?String\s*(\[\s*\]|\.\.\.)")
+    JAVA_MC_NAME = b"main"
+    JAVA_MC_DESC = b"([Ljava/lang/String;)V"
+    JAVA_ACC_PUBLIC_STATIC = 0x0009
+
+    # size of each constant pool entry after its tag, Utf8 (tag 1) has a variable size
+    JAVA_CP_SIZE = {3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4, 15: 3, 16: 2, 17: 4, 18: 4, 19: 2, 20: 2}
+
+    # path to (mtime, size, result) of files already scanned for main
+    mainCache = dict()
+
+    # results of compileWithStatus
+    CC_HIT      = "hit"
+    CC_MISS     = "miss"
+    CC_FAILURE  = "failure"
 
     STDERR = ["2>" + os.path.devnull]
 
     @staticmethod
     def execute(cmd):
         tmpf = tempfile.NamedTemporaryFile()
-        p = sp.Popen(cmd.split(), stdout=tmpf)
+        try:
+            p = sp.Popen(cmd.split(), stdout=tmpf)
+        except OSError:
+            # the command itself is missing
+            tmpf.close()
+            return None
         p.wait()
         tmpf.seek(0)
         if p.poll() == 0:
@@ -54,32 +262,96 @@ class Runner:
             return None
 
     @staticmethod
-    def getMainclassFromSource(partiPath):
-        files = allFilesUnder(partiPath, r".*\.java")
+    def hasMainMethod(data):
+        '''
+        return true iff bytes `data`, the content of a .class file, declares
+        public static void main(String[]); the constant pool and method table are parsed directly
+        '''
+        if data[:4] != b"\xca\xfe\xba\xbe":
+            return False
+        try:
+            (count,) = struct.unpack_from(">H", data, 8)
+            pos = 10
+            utf8 = dict()
+            i = 1
+            while i < count:
+                tag = data[pos]
+                pos += 1
+                if tag == 1:
+                    (length,) = struct.unpack_from(">H", data, pos)
+                    utf8[i] = data[pos+2:pos+2+length]
+                    pos += 2 + length
+                else:
+                    pos += Runner.JAVA_CP_SIZE[tag]
+                # long and double take two entries
+                i += 2 if tag == 5 or tag == 6 else 1
+            # access_flags, this_class, super_class
+            pos += 6
+            (interfaces,) = struct.unpack_from(">H", data, pos)
+            pos += 2 + 2 * interfaces
+            # fields then methods, they share the same layout
+            for table in range(2):
+                (members,) = struct.unpack_from(">H", data, pos)
+                pos += 2
+                for j in range(members):
+                    (access, name, desc, attrs) = struct.unpack_from(">HHHH", data, pos)
+                    pos += 8
+                    if table == 1 and access & Runner.JAVA_ACC_PUBLIC_STATIC == Runner.JAVA_ACC_PUBLIC_STATIC \
+                            and utf8.get(name) == Runner.JAVA_MC_NAME and utf8.get(desc) == Runner.JAVA_MC_DESC:
+                        return True
+                    for k in range(attrs):
+                        (length,) = struct.unpack_from(">I", data, pos + 2)
+                        pos += 6 + length
+        except (KeyError, IndexError, struct.error):
+            return False
+        return False
+
+    @staticmethod
+    def cachedScan(fi, scan):
+        '''
+        return scan(fi), which is only called again once fi has been modified
+        '''
+        st = os.stat(fi)
+        cached = Runner.mainCache.get(fi)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        ret = scan(fi)
+        Runner.mainCache[fi] = (st.st_mtime_ns, st.st_size, ret)
+        return ret
+
+    @staticmethod
+    def sourceHasMain(fi):
+        with open(fi, "r", encoding="utf-8") as f:
+            content = f.read()
+        return content.find(Runner.JAVA_MC_PAT) != -1 or Runner.JAVA_MC_SRC_PAT.search(content) != None
+
+    @staticmethod
+    def bytesHasMain(fi):
+        with open(fi, "rb") as f:
+            return Runner.hasMainMethod(f.read())
+
+    @staticmethod
+    def getMainclassFromSource(partiPath, manifest = None):
+        files = filesWithExt(partiPath, "java", manifest)
         for fi in files:
             # print("in file", fi)
-            with open(fi, "r", encoding="utf-8") as f:
-                content = f.read()
-                # print(content)
-                if content.find(Runner.JAVA_MC_PAT) != -1:
-                    path = os.path.splitext(os.path.relpath(fi, partiPath))[0]
-                    return path.replace(os.path.sep, ".")
+            if Runner.cachedScan(fi, Runner.sourceHasMain):
+                path = os.path.splitext(os.path.relpath(fi, partiPath))[0]
+                return path.replace(os.path.sep, ".")
         return None
     
     @staticmethod
-    def getMainclassFromBytes(partiPath):
-        files = allFilesUnder(partiPath, r".*\.class")
+    def getMainclassFromBytes(partiPath, manifest = None):
+        files = filesWithExt(partiPath, "class", manifest)
         for fi in files:
-            cmd = " ".join(["javap", fi])
-            s = Runner.execute(cmd)
-            if s and s.find(Runner.JAVA_MC_PAT) != -1:
+            if Runner.cachedScan(fi, Runner.bytesHasMain):
                 path = os.path.splitext(os.path.relpath(fi, partiPath))[0]
-                print(partiPath, fi, path)
+                log.debug("main class of %s: %s in %s", partiPath, path, fi)
                 return path.replace(os.path.sep, ".")
         return None
 
     @staticmethod
-    def autoType(partiPath):
+    def autoType(partiPath, manifest = None):
         '''
         automatically detect the file types, pariPath should be the directory of participant
         function is based on extension of all files under partiPath, if multiple types are possible,
@@ -87,35 +359,38 @@ class Runner:
         '''
         possible = set()
         # print("in", partiPath)
-        for d in allFilesUnder(partiPath):
-            # print("got", d)
-            ext = os.path.splitext(d)[1].lower()[1:]
+        if manifest:
+            exts = manifest.extensions()
+        else:
+            exts = {os.path.splitext(d)[1].lower()[1:] for d in allFilesUnder(partiPath)}
+        for ext in exts:
             if ext in Runner.extensions:
                 possible.add(Runner.extensions[ext])
         if len(possible) != 1:
-            print(possible)
-            print("Multiple possible types, auto detection failed.")
+            log.warning("%s: possible types %s, auto detection failed", partiPath, possible)
             return None
         else:
             ext = list(possible)[0]
             return ext
 
     @staticmethod
-    def getMainFile(partiPath, language):
+    def getMainFile(partiPath, language, manifest = None):
         if language == Runner.JAVA:
-            mc = Runner.getMainclassFromBytes(partiPath)
+            mc = Runner.getMainclassFromBytes(partiPath, manifest)
             if mc == None:
-                mc = Runner.getMainclassFromSource(partiPath)
+                mc = Runner.getMainclassFromSource(partiPath, manifest)
             return mc
         return None
 
     def __init__(self):
         self.compilers = copy.deepcopy(Runner.compilers)
         self.dependencies = {Runner.JAVA: []}
+        self.cache = None
+        self.warm = False
     
     def addDependency(self, language, deps):
         self.dependencies[language] += deps
-        print(self.dependencies[language])
+        log.debug("dependencies of %s: %s", language, self.dependencies[language])
 
     def setCompiler(self, language, newOption):
         self.compilers[language] = newOption
@@ -123,17 +398,62 @@ class Runner:
     def appendCompiler(self, language, newOption):
         self.compilers[language] += newOption
 
-    def compile(self, language, partiPath, name = "*"):
+    def setWarm(self, warm = True):
+        '''
+        run Java participants in a JVM kept across cases instead of a fresh one per case,
+        see warm.WarmJava; cases run with resource limits still get a fresh JVM
+        '''
+        self.warm = warm
+
+    def setCache(self, path, maxSize = 1 << 30):
+        '''
+        keep compiled artifacts in directory path, see CompileCache
+        '''
+        self.cache = CompileCache(path, maxSize)
+
+    def getCompileCommand(self, language, partiPath, name = "*", manifest = None):
         if language == Runner.C or language == Runner.CPP:
-            cmd = self.compilers[language]
-            cmd = cmd.format(filename = name)
-            return Runner.execute(cmd) != None
+            return self.compilers[language].format(filename = name)
         elif language == Runner.JAVA:
-            mainclass = Runner.getMainclassFromSource(partiPath)
-            cmd = self.compilers[language].format(filename = mainclass, classpath = ";".join(self.dependencies[language] + [partiPath]))
-            return Runner.execute(cmd) != None
-        elif language == Runner.PYTHON:     # python doesn't need compiliation
-            return True
+            mainclass = Runner.getMainclassFromSource(partiPath, manifest)
+            if mainclass == None:
+                return None
+            filename = os.path.join(partiPath, mainclass.replace(".", os.path.sep) + ".java")
+            return self.compilers[language].format(filename = filename, classpath = ";".join(self.dependencies[language] + [partiPath]))
+        return None
+
+    def compileWithStatus(self, language, partiPath, name = "*", manifest = None):
+        '''
+        compile like compile(), return CC_HIT if artifacts were taken from the cache,
+        CC_MISS if the compiler was run successfully, CC_FAILURE otherwise
+        manifest, if given, is the Manifest of partiPath, it is refreshed after compiling
+        '''
+        if language == Runner.PYTHON:       # python doesn't need compiliation
+            return Runner.CC_HIT
+        cmd = self.getCompileCommand(language, partiPath, name, manifest)
+        if cmd == None:
+            return Runner.CC_FAILURE
+        key = None
+        if self.cache:
+            key = self.cache.key(partiPath, cmd, self.dependencies.get(language, []), manifest)
+            if self.cache.restore(key, partiPath):
+                if manifest:
+                    manifest.scan()
+                return Runner.CC_HIT
+        if not manifest:
+            before = {fi: os.path.getmtime(fi) for fi in allFilesUnder(partiPath)}
+        if Runner.execute(cmd) == None:
+            return Runner.CC_FAILURE
+        if manifest:
+            built = [os.path.join(partiPath, rel) for rel in manifest.scan() if CompileCache.isArtifact(rel)]
+        else:
+            built = [fi for fi in allFilesUnder(partiPath) if before.get(fi) != os.path.getmtime(fi)]
+        if key:
+            self.cache.store(key, partiPath, [fi for fi in built if CompileCache.isArtifact(fi) and os.path.isfile(fi)])
+        return Runner.CC_MISS
+
+    def compile(self, language, partiPath, name = "*", manifest = None):
+        return self.compileWithStatus(language, partiPath, name, manifest) != Runner.CC_FAILURE
 
     def getRunningOption(self, language, partiPath, mainFile):
         "getting running option"
@@ -142,6 +462,8 @@ class Runner:
             cmd = [mainFile] + Runner.STDERR
         elif language == Runner.JAVA:
             cmd = ["java", "-cp", ";".join(self.dependencies[language] + [partiPath]), mainFile]
+            if self.warm:
+                cmd = warm.WarmJava(cmd, self.dependencies[language] + [partiPath], mainFile)
         elif language == Runner.PYTHON:
             cmd = ["python", mainFile]
         return cmd
@@ -151,6 +473,8 @@ class ParticipantManager:
     Class Manager
     in charge of manage all participants' scorce codes and programs, uncompiled and compiled
     '''
+    MANIFEST = ".manifest.json"
+
     def __init__(self, _path):
         '''
         _path is the directory of participants. Each participant should be contained in a single 
@@ -162,42 +486,105 @@ class ParticipantManager:
         self.runnable = dict()
         self.mainFile = dict()
         self.runningOption = dict()
+        self.compileLog = dict()
+        self.manifests = dict()
+        self.changed = dict()
+
+    def loadManifests(self):
+        '''
+        return manifests saved by the previous session, as a dict of name to Manifest.toDict()
+        '''
+        try:
+            with open(os.path.join(self.path, ParticipantManager.MANIFEST), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def saveManifests(self):
+        tmp = os.path.join(self.path, ParticipantManager.MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({name: m.toDict() for name, m in self.manifests.items()}, f)
+        os.replace(tmp, os.path.join(self.path, ParticipantManager.MANIFEST))
 
     def detectParticipant(self):
         '''
         detect all directory under self.path, each child directory will be regarded as a participant
+        each participant's directory is scanned once into self.manifests, and self.changed tells
+        whether its sources changed since the manifests were saved last time
         '''
+        previous = self.loadManifests()
         # detect all files under path
-        for d in glob.glob(os.path.join(self.path, "*")):
-            # if it is a name
-            if os.path.isdir(d):
-                name = os.path.basename(d)
+        for d in sorted(os.scandir(self.path), key=lambda d: d.name):
+            # if it is a name, hidden directories (like the old glob("*") skipped) are not
+            if d.is_dir() and not d.name.startswith("."):
+                name = d.name
                 self.names.append(name)
                 partiPath = os.path.join(self.path, name)
-                tp = Runner.autoType(partiPath)
+                manifest = Manifest(partiPath, previous.get(name))
+                changed = manifest.scan()
+                self.manifests[name] = manifest
+                self.changed[name] = name not in previous or any(not CompileCache.isArtifact(rel) for rel in changed)
+                tp = Runner.autoType(partiPath, manifest)
                 if tp != None:
                     self.types[name] = tp
-                    self.mainFile[name] = Runner.getMainFile(partiPath, tp)
-        print(self.mainFile)
+                    self.mainFile[name] = Runner.getMainFile(partiPath, tp, manifest)
+        self.saveManifests()
+        log.info("participants detected: %s", self.mainFile)
         return len(self.names)
 
+    def compileAll(self, runner, workers = None):
+        '''
+        compile all participants in parallel, return self.compileLog, which is a dict of
+        name to Runner.CC_HIT, CC_MISS or CC_FAILURE
+        '''
+        def work(name):
+            partiPath = os.path.join(self.path, name)
+            manifest = self.manifests.get(name)
+            tp = self.types.get(name)
+            if tp == None:
+                return Runner.CC_FAILURE
+            target = "*"
+            if tp == Runner.C or tp == Runner.CPP:
+                sources = filesWithExt(partiPath, "c" if tp == Runner.C else "cpp", manifest)
+                if sources:
+                    target = sources[0]
+            return runner.compileWithStatus(tp, partiPath, target, manifest)
+        with cf.ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+            for (name, status) in zip(self.names, pool.map(work, self.names)):
+                self.compileLog[name] = status
+        self.saveManifests()
+        return self.compileLog
+
     def getRunningOption(self, runner):
         for name in self.names:
             self.runningOption[name] = runner.getRunningOption(self.types[name], os.path.join(self.path, name), self.mainFile[name])
 
 class DataManager:
+    TIMED_PATTERN = r"\[{time}\]{data}"
+
     @staticmethod
-    def parseTimedInput(filepath, pattern=r"\[{time}\]{data}"):
-        pat = pattern.format(time=r"(.*)", data=r"(.*)")
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-            ret = []
-            for line in lines:
-                #print(pat, line)
-                group = re.match(pat, line).groups()
-                ret.append((float(group[0]), group[1]))
-            return ret
-        return None
+    def timedRegex(pattern):
+        '''
+        return the regex (bytes) TimedInput parses with, None for the default pattern
+        '''
+        if pattern == DataManager.TIMED_PATTERN:
+            return None
+        return pattern.format(time=r"(.*)", data=r"(.*)").encode()
+
+    @staticmethod
+    def parseTimedString(content, pattern=TIMED_PATTERN):
+        '''
+        parse the content of a timed input file, which is already in memory, see TimedInput
+        '''
+        return TimedInput.parse(content, DataManager.timedRegex(pattern))
+
+    @staticmethod
+    def parseTimedInput(filepath, pattern=TIMED_PATTERN, cache=True):
+        '''
+        parse timed input file `filepath` into a TimedInput; if cache is true, a binary copy is kept
+        next to the file, and used instead of parsing as long as the file doesn't change
+        '''
+        return TimedInput.load(filepath, DataManager.timedRegex(pattern), cache)
     
     @staticmethod
     def formatOutputName(names, outputPath, inputfile, pattern="{names}_{inputfile}.out"):
@@ -211,23 +598,143 @@ class DataManager:
         self.maker = _maker
         self.counter = 0
         self.data = []
+        self.seeds = dict()
         self.prefix = time.strftime("%Y-%m-%d-%H-%M-%S-", time.localtime())
         self.suffix = ".in"
+        self.lock = threading.Lock()
+        self.ready = None
+        self.prefetchLeft = None
+        self.prefetchStop = threading.Event()
+        self.prefetchers = []
+
+    def __getstate__(self):
+        # background generation stays in the process which started it
+        state = dict(self.__dict__)
+        for key in ("lock", "ready", "prefetchStop", "prefetchers"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.ready = None
+        self.prefetchStop = threading.Event()
+        self.prefetchers = []
+
+    def newName(self, seed):
+        '''
+        reserve the name of the next data file, which is generated with `seed`
+        '''
+        with self.lock:
+            name = os.path.join(self.path, self.prefix+str(self.counter)+self.suffix)
+            self.counter += 1
+            self.data.append(name)
+            self.seeds[name] = seed
+        return name
+
+    def generateContent(self, seed):
+        '''
+        run the maker with `seed` and return its output as a string; raise sp.TimeoutExpired if
+        it runs too long, and sp.CalledProcessError if it fails, its output is not data then
+        '''
+        cmd = self.maker + [str(seed)]
+        p = sp.Popen(cmd, stdout=sp.PIPE)
+        try:
+            out = p.communicate(timeout=60)[0]
+        except sp.TimeoutExpired:
+            p.kill()
+            p.communicate()
+            raise
+        if p.returncode != 0:
+            raise sp.CalledProcessError(p.returncode, cmd)
+        return out.decode()
 
     def generateData(self, number = 1):
+        '''
+        generate `number` data files right now, return their paths; raise like generateContent()
+        '''
         ret = []
         for i in range(number):
-            name = os.path.join(self.path, self.prefix+str(self.counter)+self.suffix)
-            with open(name, "w") as of:
-                self.counter += 1
-                cmd = self.maker + [ str(random.randint(1, 1000000000))]
-                #print(cmd)
-                p = sp.Popen(cmd, stdout=of)
-                p.wait(60)
-                self.data.append(name)
-                ret.append(name)
+            seed = random.randint(1, 1000000000)
+            ret.append(self.saveContent(seed, self.generateContent(seed)))
         return ret
 
+    def _prefetch(self):
+        while not self.prefetchStop.is_set():
+            with self.lock:
+                if self.prefetchLeft == 0:
+                    return
+                if self.prefetchLeft != None:
+                    self.prefetchLeft -= 1
+            seed = random.randint(1, 1000000000)
+            try:
+                item = (seed, self.generateContent(seed))
+            except Exception as e:
+                # handed to nextData(), which raises it
+                item = (None, e)
+            while not self.prefetchStop.is_set():
+                try:
+                    self.ready.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+            if item[0] == None:
+                return
+
+    def startPrefetch(self, depth = 4, workers = 1, count = None):
+        '''
+        start `workers` background threads which keep up to `depth` generated data ready ahead of time,
+        take them with nextData(); if count is given, no more than `count` data are generated in all,
+        and nextData() may be called only that many times
+        '''
+        self.stopPrefetch()
+        self.prefetchLeft = count
+        self.ready = queue.Queue(depth)
+        self.prefetchStop.clear()
+        self.prefetchers = [threading.Thread(target=self._prefetch, daemon=True) for i in range(workers)]
+        for t in self.prefetchers:
+            t.start()
+
+    def stopPrefetch(self):
+        '''
+        stop background generation, data generated but not taken is dropped
+        '''
+        self.prefetchStop.set()
+        for t in self.prefetchers:
+            t.join()
+        self.prefetchers = []
+
+    def saveContent(self, seed, content):
+        '''
+        write content generated with `seed` as the next data file, return its path
+        '''
+        name = self.newName(seed)
+        with open(name, "w", newline="") as of:
+            of.write(content)
+        return name
+
+    def nextData(self):
+        '''
+        return a tuple (path, content) of the next data file, content is its text, so it
+        needn't be read again; generate it right now if no prefetch is running.
+        the file is written only now, raise what generating it raised
+        '''
+        if self.prefetchers:
+            (seed, content) = self.ready.get()
+            if seed == None:
+                self.stopPrefetch()
+                raise content
+        else:
+            seed = random.randint(1, 1000000000)
+            content = self.generateContent(seed)
+        return (self.saveContent(seed, content), content)
+
+    def savedData(self):
+        '''
+        return the paths of all data files saved in self.path, sorted
+        '''
+        return sorted(entry.path for entry in os.scandir(self.path) if entry.is_file() and entry.name.endswith(self.suffix))
+
     def resetCounter(self):
         self.prefix = time.strftime("%Y-%m-%d-%H-%M-%S-", time.localtime())
         self.counter = 0
@@ -237,12 +744,165 @@ class DataManager:
 
     def clearBuffer(self):
         for i in range(len(self.data)):
-            os.remove(self.getRealPath(self.data[i]))
+            self.removeFile(self.getRealPath(self.data[i]))
         self.data = []
 
     def removeData(self, name):
         if name in self.data:
-            os.remove(self.getRealPath(name))
+            self.removeFile(self.getRealPath(name))
+
+    @staticmethod
+    def removeFile(path):
+        '''
+        remove data file `path` and its TimedInput cache
+        '''
+        os.remove(path)
+        cache = TimedInput.cachePath(path)
+        if os.path.exists(cache):
+            os.remove(cache)
+
+class ResultStore:
+    '''
+    Class ResultStore
+    in charge of keeping results of all runs in a SQLite database, one row per participant per data;
+    rows are inserted in batches of batchSize
+    '''
+    COLUMNS = ["time", "data", "dataHash", "seed", "name", "verdict", "wallTime", "cpuTime", "peakMemory"]
+
+    def __init__(self, _path, _batchSize = 1000):
+        self.path = _path
+        self.batchSize = _batchSize
+        self.pending = []
+        self.remembered = []
+        self.conn = None
+
+    def __getstate__(self):
+        # the connection belongs to the process which opened it
+        return {"path": self.path, "batchSize": self.batchSize, "pending": [], "remembered": [], "conn": None}
+
+    def connect(self):
+        if self.conn == None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS result (
+                id INTEGER PRIMARY KEY, time REAL, data TEXT, dataHash TEXT, seed INTEGER,
+                name TEXT, verdict INTEGER, wallTime REAL, cpuTime REAL, peakMemory INTEGER)''')
+            self.conn.execute("CREATE INDEX IF NOT EXISTS resultName ON result (name, verdict)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS resultVerdict ON result (verdict, id)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS resultWallTime ON result (wallTime)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS resultDataHash ON result (dataHash)")
+            # verdicts kept for incremental runs, see remember() and recall()
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS verdict (
+                key TEXT PRIMARY KEY, time REAL, name TEXT, dataHash TEXT, verdict INTEGER,
+                wallTime REAL, cpuTime REAL, peakMemory INTEGER)''')
+            self.conn.commit()
+        return self.conn
+
+    def add(self, data, dataHash, seed, name, verdict, wallTime = None, cpuTime = None, peakMemory = None):
+        self.pending.append((time.time(), data, dataHash, seed, name, verdict, wallTime, cpuTime, peakMemory))
+        if len(self.pending) >= self.batchSize:
+            self.flush()
+
+    def remember(self, key, name, dataHash, verdict, wallTime = None, cpuTime = None, peakMemory = None):
+        '''
+        keep the verdict of participant `name` under `key`, which identifies everything the verdict
+        depends on, replacing what was kept under the same key
+        '''
+        self.remembered.append((key, time.time(), name, dataHash, verdict, wallTime, cpuTime, peakMemory))
+        if len(self.remembered) >= self.batchSize:
+            self.flush()
+
+    def recall(self, keys):
+        '''
+        return a dict of key to (verdict, (wall time, cpu time, peak memory)) of all keys remembered
+        '''
+        self.flush()
+        keys = list(keys)
+        conn = self.connect()
+        ret = dict()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            sql = "SELECT key, verdict, wallTime, cpuTime, peakMemory FROM verdict WHERE key IN ({})".format(", ".join("?" * len(chunk)))
+            for row in conn.execute(sql, chunk):
+                ret[row[0]] = (row[1], tuple(row[2:]))
+        return ret
+
+    def flush(self):
+        if not self.pending and not self.remembered:
+            return
+        conn = self.connect()
+        with conn:
+            if self.pending:
+                conn.executemany("INSERT INTO result ({}) VALUES ({})".format(
+                    ", ".join(ResultStore.COLUMNS), ", ".join("?" * len(ResultStore.COLUMNS))), self.pending)
+            if self.remembered:
+                conn.executemany("INSERT OR REPLACE INTO verdict (key, time, name, dataHash, verdict, wallTime, cpuTime, peakMemory) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.remembered)
+        self.pending = []
+        self.remembered = []
+
+    def close(self):
+        self.flush()
+        if self.conn != None:
+            self.conn.close()
+            self.conn = None
+
+    def query(self, where = "", args = (), order = "id", limit = None):
+        '''
+        return an iterator over rows (as dicts) matching the SQL condition `where`
+        '''
+        self.flush()
+        sql = "SELECT {} FROM result".format(", ".join(ResultStore.COLUMNS))
+        if where:
+            sql += " WHERE " + where
+        sql += " ORDER BY " + order
+        if limit != None:
+            sql += " LIMIT {:d}".format(limit)
+        for row in self.connect().execute(sql, args):
+            yield dict(zip(ResultStore.COLUMNS, row))
+
+    def failures(self, name):
+        '''
+        return all runs of participant `name` not accepted
+        '''
+        return list(self.query("name = ? AND verdict != ?", (name, ResultManager.AC)))
+
+    def slowest(self, limit = 10):
+        '''
+        return the `limit` runs with the longest wall time
+        '''
+        return list(self.query("wallTime IS NOT NULL", (), "wallTime DESC", limit))
+
+    def firstFailingSeed(self, name = None):
+        '''
+        return the seed of the earliest run not accepted (of participant `name`, if given), or None
+        '''
+        if name == None:
+            rows = list(self.query("verdict != ?", (ResultManager.AC,), "id", 1))
+        else:
+            rows = list(self.query("name = ? AND verdict != ?", (name, ResultManager.AC), "id", 1))
+        return rows[0]["seed"] if rows else None
+
+    def exportCSV(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(ResultStore.COLUMNS)
+            for row in self.query():
+                writer.writerow([row[col] for col in ResultStore.COLUMNS])
+
+    def exportJSON(self, path):
+        '''
+        write all rows as a JSON list, one row at a time
+        '''
+        with open(path, "w") as f:
+            f.write("[")
+            first = True
+            for row in self.query():
+                f.write("\n" if first else ",\n")
+                json.dump(row, f)
+                first = False
+            f.write("\n]\n")
 
 class ResultManager:
     AC  = 0
@@ -250,14 +910,35 @@ class ResultManager:
     RE  = 2
     TLE = 3
     PE  = 4
-    def __init__(self, pm):
+    MLE = 5
+    OLE = 6
+    VERDICT_NAMES = {AC: "AC", WA: "WA", RE: "RE", TLE: "TLE", PE: "PE", MLE: "MLE", OLE: "OLE"}
+    def __init__(self, pm, store = None):
+        '''
+        store, if given, is a ResultStore which keeps every row added
+        '''
         self.names = pm.names
         self.result = dict()
+        self.usage = dict()
+        self.store = store
     
-    def addRow(self, data, result):
+    def addRow(self, data, result, usage = None, seed = None):
+        '''
+        usage, if given, is a dict of name to (wall time, cpu time, peak memory) of that run
+        seed is the seed data was generated with, only kept by self.store
+        '''
         self.result[data] = dict()
         for name in self.names:
             self.result[data][name] = result[name]
+        if usage:
+            self.usage[data] = dict(usage)
+        if self.store:
+            dataHash = Manifest.hashFile(data) if os.path.isfile(data) else None
+            for name in self.names:
+                self.store.add(data, dataHash, seed, name, result[name], *(usage or dict()).get(name, ()))
     
     def getRow(self, data):
         return self.result[data]
+
+    def getUsage(self, data):
+        return self.usage.get(data, dict())
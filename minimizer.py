@@ -0,0 +1,191 @@
+import os
+import hashlib
+import tempfile
+import threading
+import concurrent.futures as cf
+import feeder
+import manager
+import contest
+
+class Minimizer:
+    '''
+    Class Minimizer
+    in charge of shrinking a failing timed input (as returned by DataManager.parseTimedInput) with
+    delta debugging: the failing participant and the reference are run on smaller and smaller subsets
+    of the input until no single line can be removed without the failure going away. a candidate only
+    fails if it gets the same verdict as the whole input (WA, RE, TLE, ...), so a wrong answer doesn't
+    shrink into an unrelated crash or timeout.
+    candidates are run with fresh processes (not warm.WarmJava), and judged one at a time, as the
+    judge may hold a single SPJ process
+    '''
+    SUFFIX = ".min"
+    def __init__(self, contest, name, reference = None, workers = 4, timeOut = None, compress = True):
+        '''
+        contest     an initialized Contest, whose running options and judge are used
+        name        the failing participant
+        reference   the participant whose output is regarded as correct, contest.std by default
+        workers     number of candidate inputs tried at the same time
+        timeOut     time (in sec) each candidate may take, contest.timeOutFor() of the input by default
+        compress    whether to also shrink time offsets once no line can be removed
+        '''
+        self.contest = contest
+        self.name = name
+        self.reference = reference if reference else contest.std
+        self.workers = workers
+        self.timeOut = timeOut
+        self.compress = compress
+        self.runningOption = dict()
+        for n in (name, self.reference):
+            ro = contest.participant.runningOption[n]
+            self.runningOption[n] = getattr(ro, "cmd", ro)
+        self.cache = dict()
+        self.lock = threading.Lock()
+        self.judgeLock = threading.Lock()
+        self.tests = 0
+        self.tmpdir = tempfile.mkdtemp(prefix="minimize-")
+        # the verdict of the input being minimized, and the time each candidate may take, see minimize()
+        self.target = None
+        self.runTimeOut = timeOut
+
+    @staticmethod
+    def format(inputlist):
+        return "".join("[{}]{}\n".format(tim, content) for (tim, content) in inputlist)
+
+    def key(self, inputlist):
+        return hashlib.sha256(Minimizer.format(inputlist).encode()).hexdigest()
+
+    def fails(self, inputlist):
+        '''
+        return true iff self.name still fails on inputlist with the verdict of the input minimized
+        '''
+        return self.verdict(inputlist) == self.target
+
+    def verdict(self, inputlist):
+        '''
+        return the verdict of self.name on inputlist, judged against self.reference; verdicts are
+        cached by input hash and time out
+        '''
+        key = (self.key(inputlist), self.runTimeOut)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            self.tests += 1
+        data = os.path.join(self.tmpdir, key[0] + ".in")
+        with open(data, "w") as f:
+            f.write(Minimizer.format(inputlist))
+        names = [self.name, self.reference]
+        outputname = manager.DataManager.formatOutputName(names, self.tmpdir, os.path.basename(data))
+        fdr = feeder.Feeder(
+            names,
+            self.runningOption,
+            feeder.Feeder.IM_TIMED_STRING,
+            inputlist,
+            feeder.Feeder.OM_CLASSIC,
+            outputname,
+            self.runTimeOut,
+            _limits = self.contest.limits,
+            _timedOutput = self.contest.timedOutput
+        )
+        fdr.startAll()
+        state = fdr.finishState.get(self.name, feeder.Feeder.FS_OK)
+        if state in contest.RUNTIME_VERDICT:
+            ret = contest.RUNTIME_VERDICT[state]
+        else:
+            with self.judgeLock:
+                (ac, s) = self.contest.judge.getCompareTool()(data, outputname[self.reference], outputname[self.name])
+            ret = manager.ResultManager.AC if ac else manager.ResultManager.WA
+        for path in [data] + list(outputname.values()):
+            if os.path.exists(path):
+                os.remove(path)
+        with self.lock:
+            self.cache[key] = ret
+        return ret
+
+    def firstFailing(self, candidates):
+        '''
+        try all candidates in parallel, return the first one (in order) which still fails, or None
+        '''
+        with cf.ThreadPoolExecutor(self.workers) as pool:
+            results = list(pool.map(self.fails, candidates))
+        for (candidate, ret) in zip(candidates, results):
+            if ret:
+                return candidate
+        return None
+
+    def ddmin(self, inputlist):
+        '''
+        return a 1-minimal failing subset of inputlist, which must fail itself
+        '''
+        n = 2
+        while len(inputlist) >= 2:
+            size = len(inputlist)
+            chunks = [inputlist[size*i//n : size*(i+1)//n] for i in range(n)]
+            subsets = [c for c in chunks if c]
+            complements = [inputlist[:size*i//n] + inputlist[size*(i+1)//n:] for i in range(n)]
+            found = self.firstFailing(subsets)
+            if found != None:
+                (inputlist, n) = (found, 2)
+                continue
+            found = self.firstFailing([c for c in complements if c]) if n > 2 else None
+            if found != None:
+                (inputlist, n) = (found, max(n - 1, 2))
+                continue
+            if n >= size:
+                break
+            n = min(size, n * 2)
+        return inputlist
+
+    def compressTimes(self, inputlist):
+        '''
+        return inputlist with time offsets shrunk as far as it still fails: gaps between
+        consecutive lines are halved as long as possible, then removed when possible
+        '''
+        while True:
+            base = inputlist[0][0] if inputlist else 0.0
+            candidates = [
+                [(0.0, c) for (t, c) in inputlist],
+                [(round(base + (t - base) / 2, 3), c) for (t, c) in inputlist],
+            ]
+            candidates = [c for c in candidates if c != inputlist]
+            found = self.firstFailing(candidates)
+            if found == None:
+                return inputlist
+            inputlist = found
+
+    def minimize(self, inputlist, output = None, timeOut = None):
+        '''
+        return the smallest input found starting from inputlist which fails with the same verdict,
+        it is written to file path `output` if given; inputlist is returned as is if it doesn't fail.
+        timeOut is the time (in sec) each candidate may take, by default the one given to the
+        constructor, or contest.timeOutFor() of inputlist
+        '''
+        inputlist = sorted(inputlist, key=lambda pair: pair[0])
+        if timeOut == None:
+            timeOut = self.timeOut
+        if timeOut == None:
+            data = os.path.join(self.tmpdir, "original.in")
+            with open(data, "w") as f:
+                f.write(Minimizer.format(inputlist))
+            timeOut = self.contest.timeOutFor(data)
+            os.remove(data)
+        self.runTimeOut = timeOut
+        self.target = self.verdict(inputlist)
+        if self.target == manager.ResultManager.AC:
+            return inputlist
+        inputlist = self.ddmin(inputlist)
+        if self.compress:
+            inputlist = self.compressTimes(inputlist)
+        if output:
+            with open(output, "w") as f:
+                f.write(Minimizer.format(inputlist))
+        return inputlist
+
+    def minimizeFile(self, data):
+        '''
+        minimize data file `data`, the reproducer is written next to it as <data>.min, which
+        DataManager.savedData() doesn't take as data
+        '''
+        output = os.path.splitext(data)[0] + Minimizer.SUFFIX
+        timeOut = self.timeOut if self.timeOut != None else self.contest.timeOutFor(data)
+        self.minimize(manager.DataManager.parseTimedInput(data), output, timeOut)
+        return output
@@ -0,0 +1,89 @@
+import os
+import signal
+import subprocess as sp
+try:
+    import resource
+except ImportError:
+    # not available on Windows, limits are not applied there
+    resource = None
+
+# run by every limited program: stop until its limits are applied from outside, then become the program
+BARRIER = 'kill -STOP $$; exec "$@"'
+SHELL = "/bin/sh"
+
+def available():
+    '''
+    return true iff limits can be applied to another process here, with resource.prlimit
+    '''
+    return resource != None and hasattr(resource, "prlimit") and hasattr(os, "waitid") and os.path.exists(SHELL)
+
+def resources(limits):
+    '''
+    return the list of (resource, (soft, hard)) standing for the dict of limits, see Feeder;
+    "memory" is not among them, as Feeder watches the resident memory itself
+    '''
+    ret = []
+    if not limits or resource == None:
+        return ret
+    if "cpu" in limits:
+        # SIGXCPU at the limit, SIGKILL a second later
+        cpu = int(limits["cpu"] + 0.999)
+        ret.append((resource.RLIMIT_CPU, (cpu, cpu + 1)))
+    if "address" in limits:
+        ret.append((resource.RLIMIT_AS, (limits["address"], limits["address"])))
+    if "processes" in limits:
+        ret.append((resource.RLIMIT_NPROC, (limits["processes"], limits["processes"])))
+    return ret
+
+def apply(pid, limits):
+    '''
+    apply limits to process pid, where available
+    '''
+    if not available():
+        return
+    for (res, value) in resources(limits):
+        resource.prlimit(pid, res, value)
+
+def needed(limits):
+    '''
+    return true iff some of limits has to be applied to each program, and can be
+    '''
+    return available() and bool(resources(limits))
+
+def wrap(cmd):
+    '''
+    return the command which runs cmd held at the barrier, see release()
+    '''
+    return [SHELL, "-c", BARRIER, "sh"] + list(cmd)
+
+def release(pid, limits):
+    '''
+    wait for process pid, started with wrap(), to reach the barrier, then apply limits to it and let
+    it go on; it is killed if they can't be applied
+    '''
+    # WNOWAIT: an exit is left for the owner of pid to reap
+    info = os.waitid(os.P_PID, pid, os.WSTOPPED | os.WEXITED | os.WNOWAIT)
+    if info.si_code != os.CLD_STOPPED:
+        return
+    try:
+        apply(pid, limits)
+    except:
+        os.kill(pid, signal.SIGKILL)
+        raise
+    os.kill(pid, signal.SIGCONT)
+
+def popen(cmd, limits = None, **kwargs):
+    '''
+    return sp.Popen(cmd, **kwargs), where limits are applied to the program before it runs.
+    no code runs in the forked child (unlike preexec_fn), so this is safe while other threads run
+    '''
+    if not needed(limits):
+        return sp.Popen(cmd, **kwargs)
+    p = sp.Popen(wrap(cmd), **kwargs)
+    try:
+        release(p.pid, limits)
+    except:
+        p.kill()
+        p.wait()
+        raise
+    return p
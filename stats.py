@@ -0,0 +1,347 @@
+import os
+import json
+import bisect
+import threading
+import time
+import http.server
+
+class Stage:
+    '''
+    Class Stage
+    the context manager returned by Timings.stage(), it records the time spent inside it
+    '''
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class Timings:
+    '''
+    Class Timings
+    in charge of timing the stages of the judge pipeline (generate, spawn, wait, judge, ...) and of
+    counting what happens in them. samples (in sec) and counters are kept by name, summarized as
+    percentiles and dumped as JSON. a disabled Timings records nothing
+    '''
+    PERCENTILES = [50, 90, 99]
+    NULL_STAGE = NullStage()
+
+    def __init__(self, enabled = True, registry = None):
+        '''
+        registry, if given, is a Registry which also gets every sample (as histogram
+        <PREFIX>_stage_seconds{stage=name}) and every count (as counter <PREFIX>_events_total{event=name})
+        '''
+        self.enabled = enabled
+        self.registry = registry
+        self.samples = dict()
+        self.counters = dict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        '''
+        return a context manager which records the time spent inside it as a sample of `name`
+        '''
+        if not self.enabled:
+            return Timings.NULL_STAGE
+        return Stage(self, name)
+
+    def record(self, name, seconds):
+        if self.enabled:
+            with self.lock:
+                self.samples.setdefault(name, []).append(seconds)
+            if self.registry:
+                self.registry.histogram("stage_seconds", "time spent in each stage", stage=name).observe(seconds)
+
+    def count(self, name, n = 1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+            if self.registry:
+                self.registry.counter("events_total", "events counted by the pipeline", event=name).inc(n)
+
+    def drain(self):
+        '''
+        return everything recorded so far as a dict, and start over; see merge()
+        '''
+        with self.lock:
+            ret = {"samples": self.samples, "counters": self.counters}
+            self.samples = dict()
+            self.counters = dict()
+        return ret
+
+    def merge(self, drained):
+        '''
+        add what drain() of another Timings (e.g. in a worker process) returned
+        '''
+        if not self.enabled:
+            return
+        for name, lst in drained["samples"].items():
+            for seconds in lst:
+                self.record(name, seconds)
+        for name, n in drained["counters"].items():
+            self.count(name, n)
+
+    @staticmethod
+    def percentile(ordered, p):
+        '''
+        return the p-th percentile (nearest rank) of the sorted list `ordered`
+        '''
+        if not ordered:
+            return None
+        rank = max(1, -(-len(ordered) * p // 100))
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def summary(self):
+        '''
+        return a dict with, for each stage, the number, total, mean, max and percentiles of its
+        samples (in sec), and the counters
+        '''
+        with self.lock:
+            samples = {name: sorted(lst) for name, lst in self.samples.items()}
+            counters = dict(self.counters)
+        stages = dict()
+        for name, ordered in samples.items():
+            total = sum(ordered)
+            stat = {"count": len(ordered), "total": total, "mean": total / len(ordered), "max": ordered[-1]}
+            for p in Timings.PERCENTILES:
+                stat["p{}".format(p)] = Timings.percentile(ordered, p)
+            stages[name] = stat
+        return {"stages": stages, "counters": counters}
+
+    def dump(self, path = None):
+        '''
+        return summary() as JSON, which is also written to file path `path` if given
+        '''
+        text = json.dumps(self.summary(), indent=2, sort_keys=True)
+        if path:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n = 1):
+        with self.lock:
+            self.value += n
+
+    def snapshot(self):
+        return self.value
+
+class Gauge(Counter):
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    '''
+    Class Histogram
+    counts observations into fixed buckets, so it takes the same memory however long the run is
+    '''
+    BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+    def __init__(self, buckets = None):
+        self.buckets = sorted(buckets) if buckets else Histogram.BUCKETS
+        # the last one counts observations above all buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += value
+
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.total
+        return {"buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+                "count": sum(counts), "sum": total}
+
+class Registry:
+    '''
+    Class Registry
+    in charge of keeping the counters, gauges and histograms of a long run in this process; each
+    metric is identified by its name and labels. metrics are exposed in Prometheus text format
+    (prometheus()) or as a dict (snapshot()), see MetricsServer and SnapshotWriter
+    '''
+    PREFIX = "duipai"
+
+    def __init__(self):
+        self.metrics = dict()
+        self.helps = dict()
+        self.kinds = dict()
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # metrics are recorded by the process which owns the registry
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def get(self, kind, factory, name, helpText, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric == None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric == None:
+                    metric = self.metrics[key] = factory()
+                    self.helps.setdefault(name, helpText)
+                    self.kinds.setdefault(name, kind)
+        return metric
+
+    def counter(self, name, helpText = "", **labels):
+        return self.get("counter", Counter, name, helpText, labels)
+
+    def gauge(self, name, helpText = "", **labels):
+        return self.get("gauge", Gauge, name, helpText, labels)
+
+    def histogram(self, name, helpText = "", buckets = None, **labels):
+        return self.get("histogram", lambda: Histogram(buckets), name, helpText, labels)
+
+    @staticmethod
+    def formatLabels(labels, extra = ()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for (k, v) in pairs) + "}"
+
+    def prometheus(self):
+        '''
+        return all metrics in Prometheus text exposition format
+        '''
+        with self.lock:
+            items = sorted(self.metrics.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+        for ((name, labels), metric) in items:
+            full = "{}_{}".format(Registry.PREFIX, name)
+            if name not in described:
+                described.add(name)
+                lines.append("# HELP {} {}".format(full, self.helps[name]))
+                lines.append("# TYPE {} {}".format(full, self.kinds[name]))
+            if isinstance(metric, Histogram):
+                snap = metric.snapshot()
+                cumulative = 0
+                for (bound, n) in snap["buckets"].items():
+                    cumulative += n
+                    lines.append("{}_bucket{} {}".format(full, Registry.formatLabels(labels, [("le", bound)]), cumulative))
+                lines.append("{}_sum{} {}".format(full, Registry.formatLabels(labels), snap["sum"]))
+                lines.append("{}_count{} {}".format(full, Registry.formatLabels(labels), snap["count"]))
+            else:
+                lines.append("{}{} {}".format(full, Registry.formatLabels(labels), metric.snapshot()))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        '''
+        return all metrics as a dict of name to a list of {"labels": ..., "value": ...}
+        '''
+        with self.lock:
+            items = sorted(self.metrics.items(), key=lambda item: item[0])
+        ret = {"time": time.time()}
+        for ((name, labels), metric) in items:
+            ret.setdefault(name, []).append({"labels": dict(labels), "value": metric.snapshot()})
+        return ret
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path == "/metrics":
+            (body, kind) = (registry.prometheus(), "text/plain; version=0.0.4")
+        elif self.path == "/metrics.json":
+            (body, kind) = (json.dumps(registry.snapshot()), "application/json")
+        else:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer:
+    '''
+    Class MetricsServer
+    serves a Registry over HTTP on its own thread: /metrics in Prometheus text format, and
+    /metrics.json as JSON; it listens on localhost only by default, port 0 picks a free port
+    '''
+    def __init__(self, registry, host = "127.0.0.1", port = 0):
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = registry
+        self.address = self.server.server_address[:2]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class SnapshotWriter:
+    '''
+    Class SnapshotWriter
+    rewrites file `path` with Registry.snapshot() as JSON every `interval` seconds, on its own thread;
+    the file is replaced atomically, so readers never see it half written
+    '''
+    def __init__(self, registry, path, interval = 5.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def write(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.registry.snapshot(), f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.write()
@@ -0,0 +1,192 @@
+import os
+import re
+import sys
+import array
+import struct
+
+class TimedInput:
+    '''
+    Class TimedInput
+    a compact timed input: the times of all lines in one array('d'), and the lines themselves in one
+    bytes blob, each followed by a newline, with their offsets in an array('Q'). lines are kept sorted
+    by time, so the lines of one time are a single slice of the blob, see batches().
+    it reads like the list of tuple (time, content) DataManager used to return: len(), indexing,
+    slicing (which gives a list) and iteration all give (float, str) tuples.
+    it can be saved next to the text file it was parsed from (see cachePath()), so replaying the
+    file later skips parsing
+    '''
+    MAGIC = b"TIN1"
+    # magic, number of lines, size of blob, size and mtime (in ns) of the text file
+    HEADER = struct.Struct("<4sQQQQ")
+    SUFFIX = ".cache"
+
+    def __init__(self, times = None, offsets = None, blob = b""):
+        self.times = times if times != None else array.array("d")
+        self.offsets = offsets if offsets != None else array.array("Q", [0])
+        self.blob = blob
+
+    @staticmethod
+    def of(inputlist):
+        '''
+        return inputlist as a TimedInput, inputlist is a TimedInput or a list of (time, content)
+        '''
+        if isinstance(inputlist, TimedInput):
+            return inputlist
+        times = array.array("d")
+        offsets = array.array("Q", [0])
+        blob = bytearray()
+        for (tim, content) in sorted(inputlist, key=lambda pair: pair[0]):
+            times.append(float(tim))
+            blob += content.encode() if isinstance(content, str) else content
+            blob += b"\n"
+            offsets.append(len(blob))
+        return TimedInput(times, offsets, bytes(blob))
+
+    @staticmethod
+    def parseLines(lines, pattern = None):
+        '''
+        parse timed input from an iterable of lines (bytes), like "[1.5]content";
+        pattern, if given, is a regex (bytes) with groups (time, content) used instead
+        '''
+        pat = re.compile(pattern) if pattern != None else None
+        times = array.array("d")
+        offsets = array.array("Q", [0])
+        blob = bytearray()
+        ordered = True
+        for line in lines:
+            line = line.rstrip(b"\r\n")
+            if not line:
+                continue
+            if pat == None:
+                end = line.index(b"]")
+                (tim, content) = (float(line[1:end]), line[end+1:])
+            else:
+                group = pat.match(line).groups()
+                (tim, content) = (float(group[0]), group[1])
+            if times and tim < times[-1]:
+                ordered = False
+            times.append(tim)
+            blob += content
+            blob += b"\n"
+            offsets.append(len(blob))
+        ret = TimedInput(times, offsets, bytes(blob))
+        return ret if ordered else TimedInput.of(ret.lines())
+
+    @staticmethod
+    def parse(content, pattern = None):
+        '''
+        parse the content (str or bytes) of a timed input file, which is already in memory
+        '''
+        if isinstance(content, str):
+            content = content.encode()
+        return TimedInput.parseLines(content.splitlines(), pattern)
+
+    @staticmethod
+    def cachePath(filepath):
+        return filepath + TimedInput.SUFFIX
+
+    @staticmethod
+    def load(filepath, pattern = None, cache = True):
+        '''
+        return the timed input in text file `filepath`; if cache is true, it is read from the
+        binary cache next to the file when that is up to date, or the cache is written after parsing
+        '''
+        st = os.stat(filepath)
+        if cache and pattern == None:
+            ret = TimedInput.readCache(TimedInput.cachePath(filepath), st)
+            if ret != None:
+                return ret
+        with open(filepath, "rb") as f:
+            # read line by line, the text is never held in memory as a whole
+            ret = TimedInput.parseLines(f, pattern)
+        if cache and pattern == None:
+            try:
+                ret.writeCache(TimedInput.cachePath(filepath), st)
+            except OSError:
+                pass
+        return ret
+
+    @staticmethod
+    def readCache(path, st):
+        '''
+        return the TimedInput in cache file `path`, or None if it is missing or doesn't belong to
+        a text file with os.stat() result `st`
+        '''
+        try:
+            with open(path, "rb") as f:
+                header = f.read(TimedInput.HEADER.size)
+                if len(header) != TimedInput.HEADER.size:
+                    return None
+                (magic, count, size, srcSize, srcMtime) = TimedInput.HEADER.unpack(header)
+                if magic != TimedInput.MAGIC or srcSize != st.st_size or srcMtime != st.st_mtime_ns:
+                    return None
+                times = array.array("d")
+                offsets = array.array("Q")
+                times.fromfile(f, count)
+                offsets.fromfile(f, count + 1)
+                blob = f.read(size)
+        except (OSError, EOFError):
+            return None
+        if len(blob) != size:
+            return None
+        if sys.byteorder != "little":
+            times.byteswap()
+            offsets.byteswap()
+        return TimedInput(times, offsets, blob)
+
+    def writeCache(self, path, st):
+        times = array.array("d", self.times)
+        offsets = array.array("Q", self.offsets)
+        if sys.byteorder != "little":
+            times.byteswap()
+            offsets.byteswap()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(TimedInput.HEADER.pack(TimedInput.MAGIC, len(self.times), len(self.blob), st.st_size, st.st_mtime_ns))
+            times.tofile(f)
+            offsets.tofile(f)
+            f.write(self.blob)
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self.times)
+
+    def line(self, i):
+        '''
+        return the content of line i as bytes, without the newline
+        '''
+        return self.blob[self.offsets[i]:self.offsets[i+1]-1]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("timed input index out of range")
+        return (self.times[i], self.line(i).decode())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield (self.times[i], self.line(i).decode())
+
+    def lines(self):
+        '''
+        return the list of (time, content) with content as bytes
+        '''
+        return [(self.times[i], self.line(i)) for i in range(len(self))]
+
+    def batches(self):
+        '''
+        iterate over (time, data), where data is the bytes of all lines of that time, each
+        followed by a newline
+        '''
+        times = self.times
+        n = len(times)
+        i = 0
+        while i < n:
+            j = i + 1
+            while j < n and times[j] == times[i]:
+                j += 1
+            yield (times[i], self.blob[self.offsets[i]:self.offsets[j]])
+            i = j
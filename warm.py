@@ -0,0 +1,229 @@
+import os
+import sys
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess as sp
+import rlimits
+
+class SocketPipe:
+    '''
+    Class SocketPipe
+    a connected socket which stands for one end of a pipe, it offers what Feeder uses of
+    Popen.stdin and Popen.stdout
+    '''
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def read(self, size = -1):
+        return self.sock.recv(size if size > 0 else 65536)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+
+class WarmProcess:
+    '''
+    Class WarmProcess
+    one case run by the JVM of a WarmJava, it offers what Feeder uses of a Popen object;
+    it holds runner.caseLock from its start until wait() returns
+    '''
+    def __init__(self, runner, stdin, stdout):
+        self.runner = runner
+        self.pid = None
+        self.returncode = None
+        self.lock = threading.Lock()
+        runner.caseLock.acquire()
+        try:
+            (sockIn, sockOut) = runner.connect()
+        except:
+            runner.caseLock.release()
+            raise
+        self.stdin = None
+        self.stdout = None
+        self.copiers = []
+        if stdin == sp.PIPE:
+            self.stdin = SocketPipe(sockIn)
+        elif stdin == None:
+            sockIn.close()
+        elif isinstance(stdin, int):
+            # the caller closes its descriptor once this returns
+            self.copy(os.fdopen(os.dup(stdin), "rb"), SocketPipe(sockIn), True)
+        else:
+            self.copy(stdin, SocketPipe(sockIn))
+        if stdout == sp.PIPE:
+            self.stdout = SocketPipe(sockOut)
+        else:
+            self.copy(SocketPipe(sockOut), stdout if stdout != None else sys.stdout.buffer)
+
+    def copy(self, src, dst, closeSrc = False):
+        def run():
+            while True:
+                data = src.read(65536)
+                if not data:
+                    break
+                dst.write(data)
+                dst.flush()
+            if isinstance(dst, SocketPipe):
+                dst.close()
+            if closeSrc or isinstance(src, SocketPipe):
+                src.close()
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        self.copiers.append(t)
+
+    def wait(self, timeout = None):
+        '''
+        wait for the case to end; timeout is not supported, kill() ends a case early
+        '''
+        with self.lock:
+            if self.returncode == None:
+                try:
+                    self.returncode = self.runner.finish()
+                finally:
+                    self.runner.caseLock.release()
+                for t in self.copiers:
+                    t.join()
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.runner.stop()
+
+class WarmJava:
+    '''
+    Class WarmJava
+    in charge of keeping one JVM for a Java participant, which runs the participant's main class
+    for each case (see harness/OjHarness.java), so JVM startup is paid only once.
+    it stands in Feeder's running options in place of a command: Feeder calls launch() instead of
+    Popen. once the harness reports that a case leaked state (threads left running, system
+    properties changed), or if the harness can't be started, the participant goes back to a fresh
+    process per case. the JVM runs one case at a time, concurrent launches wait for their turn.
+    resource limits can't be told apart per case in a shared JVM, so a case run with limits
+    always gets a fresh process
+    '''
+    HARNESS = "OjHarness"
+    HARNESS_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "harness", HARNESS + ".java")
+    harnessDir = None
+    harnessLock = threading.Lock()
+
+    @staticmethod
+    def compileHarness(javac = "javac"):
+        '''
+        compile the harness once per process, return the directory of its class, or None
+        '''
+        with WarmJava.harnessLock:
+            if WarmJava.harnessDir == None:
+                d = tempfile.mkdtemp(prefix="harness-")
+                try:
+                    ret = sp.call([javac, "-d", d, WarmJava.HARNESS_SOURCE])
+                except OSError:
+                    ret = -1
+                if ret != 0:
+                    shutil.rmtree(d, ignore_errors=True)
+                    return None
+                WarmJava.harnessDir = d
+            return WarmJava.harnessDir
+
+    def __init__(self, cmd, classpath, mainClass, java = "java"):
+        '''
+        cmd         the command which runs the participant in a fresh process
+        classpath   a list of jars and directories the participant needs
+        mainClass   the name of the participant's main class
+        '''
+        self.cmd = cmd
+        self.classpath = classpath
+        self.mainClass = mainClass
+        self.java = java
+        self.fresh = False
+        self.process = None
+        self.port = None
+        self.caseLock = threading.Lock()
+
+    def __getstate__(self):
+        # the JVM belongs to the process which started it
+        state = dict(self.__dict__)
+        state["process"] = None
+        state["port"] = None
+        del state["caseLock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.caseLock = threading.Lock()
+
+    def start(self):
+        if self.process != None and self.process.poll() == None:
+            return True
+        harness = WarmJava.compileHarness()
+        if harness == None:
+            self.fresh = True
+            return False
+        self.process = sp.Popen([self.java, "-cp", harness, WarmJava.HARNESS, self.mainClass] + self.classpath,
+                                stdin=sp.PIPE, stdout=sp.PIPE, universal_newlines=True, bufsize=1)
+        line = self.process.stdout.readline().split()
+        if len(line) != 2 or line[0] != "PORT":
+            self.stop()
+            self.fresh = True
+            return False
+        self.port = int(line[1])
+        return True
+
+    def connect(self):
+        '''
+        start a case, return the sockets (stdin, stdout) of it; self.caseLock must be held until
+        finish() returns
+        '''
+        self.process.stdin.write("RUN\n")
+        self.process.stdin.flush()
+        sockIn = socket.create_connection(("127.0.0.1", self.port))
+        sockOut = socket.create_connection(("127.0.0.1", self.port))
+        sockIn.shutdown(socket.SHUT_RD)
+        sockOut.shutdown(socket.SHUT_WR)
+        return (sockIn, sockOut)
+
+    def finish(self):
+        '''
+        wait for the current case to end, return its exit code
+        '''
+        process = self.process
+        if process == None:
+            return -9
+        line = process.stdout.readline().split()
+        if len(line) == 3 and line[0] == "EXIT":
+            if line[2] != "0":
+                self.fresh = True
+                self.stop()
+            return int(line[1])
+        # the JVM itself has exited, by System.exit() or by being killed
+        code = process.wait()
+        self.process = None
+        return code
+
+    def stop(self):
+        process = self.process
+        if process != None:
+            if process.poll() == None:
+                process.kill()
+            process.wait()
+            self.process = None
+
+    def launch(self, stdin, stdout, limits = None):
+        '''
+        start one case like Popen(cmd, stdin=stdin, stdout=stdout) would, limits is the dict of
+        resource limits of Feeder
+        '''
+        if not limits and not self.fresh and self.start():
+            return WarmProcess(self, stdin, stdout)
+        return rlimits.popen(self.cmd, limits, stdin = stdin, stdout = stdout)